@@ -0,0 +1,289 @@
+"""
+Timing scripts for the headless parts of the grape pipeline.
+
+Run ``python benchmarks.py`` outside Blender; every benchmark prints one
+line per problem size. Run inside Blender, the branch mesh benchmark also
+times the Skin + Subdivision modifier stack the tubes replace.
+"""
+import os
+import tracemalloc
+from copy import deepcopy
+from time import perf_counter
+
+import numpy as np
+
+from berries import neighbour_pairs, occluded, relax, sphere_mesh
+from blender_mesh import add_skin, draw_tubes, in_blender, merged_spheres, object_from_arrays
+from grape_lsystem import GrapeLSystem
+from lod import HIGH, MEDIUM, LOW
+from rewriting import rewrite
+from tubes import tube_mesh
+from turtle_np import StateStack, Turtle, draw, draw_vectorized
+from vineyard import build_cluster, generate, random_specs
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+FRAGMENT = "E(0,0,1.0)[Ap(1)][+(45)Ap(1)][-(45)Ap(1)]"
+PREDECESSORS = ("Ap", "E")
+
+
+def produce(name, args):
+    if name == "E":
+        return "+(0.0)!(0.1)F(1.0)"
+    return "E(1,0,1)S(0)"
+
+
+def quadratic_rewrite(string):
+    """The replacement loop GrapeLSystem.extract_rules used to run."""
+    replacements = []
+    for k, c in enumerate(string):
+        if c == "E" or string[k:k+2] == "Ap":
+            next_string = string[k:].split(")")[0]
+            name = next_string.split("(")[0]
+            replacements.append([k, k + len(next_string), produce(name, None)])
+
+    decalage = 0
+    for start, end, new_comand in replacements:
+        length_diff = len(new_comand) - (end-start)
+        before = string[:max(0, start+decalage)]
+        after = string[min(end+decalage, len(string)):]
+        string = before + new_comand + after
+        decalage += length_diff
+    return string
+
+
+def timed(function, *args):
+    t0 = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - t0
+
+
+def bench_rewriting(sizes=(10**3, 10**4, 10**5, 10**6, 10**7), quadratic_limit=2*10**5):
+    print("rewriting: symbols, one-pass ms, ns/symbol, quadratic ms")
+    for size in sizes:
+        string = FRAGMENT * (size // len(FRAGMENT) + 1)
+        result, elapsed = timed(rewrite, string, produce, PREDECESSORS)
+        line = f"{len(string):>10} {elapsed*1000:>10.1f} {elapsed/len(string)*1e9:>8.1f}"
+        if len(string) <= quadratic_limit:
+            reference, slow = timed(quadratic_rewrite, string)
+            assert reference == result
+            line += f" {slow*1000:>10.1f}"
+        print(line)
+
+
+def derived_cluster(m, ns):
+    grappe = GrapeLSystem(m=m, ns=[ns]*(m-1))
+    grappe.iterate(n_iter=m + ns + 4)
+    return grappe
+
+
+def bench_expansion(sizes=((20, 15), (60, 45), (120, 100), (170, 140))):
+    """Level-by-level rewriting against the shared expansion DAG."""
+    print("expansion: modules, level-by-level ms, dag ms, dag nodes")
+    for m, ns in sizes:
+        grappe = GrapeLSystem(m=m, ns=[ns]*(m-1))
+        n_iter = m + ns + 4
+
+        def levels():
+            omega = grappe.axiom()
+            for iteration in range(n_iter):
+                omega = grappe.extract_rules(omega)
+            return omega
+
+        reference, slow = timed(levels)
+        _, fast = timed(grappe.iterate, n_iter)
+        assert grappe.instructions == reference
+        print(f"{len(reference):>10} {slow*1000:>10.1f} {fast*1000:>10.1f} {len(grappe.expansion):>10}")
+
+
+def bench_interpretation(sizes=((20, 15), (60, 45), (120, 100), (170, 140))):
+    print("interpretation: segments, turtle ms, vectorized ms, speedup")
+    for m, ns in sizes:
+        modules = derived_cluster(m, ns).instructions
+        reference, slow = timed(draw, modules)
+        result, fast = timed(draw_vectorized, modules)
+        assert (reference.edges == result.edges).all()
+        assert np.allclose(reference.vertices, result.vertices)
+        assert (reference.finitions == result.finitions).all()
+        print(f"{len(result.edges):>10} {slow*1000:>10.1f} {fast*1000:>10.1f} {slow/fast:>8.1f}")
+
+
+def peak_memory(function, *args):
+    """Result of ``function`` and the peak memory it allocated, in bytes."""
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def bench_streaming(sizes=((20, 15), (60, 45), (120, 100))):
+    """Peak memory of deriving then drawing against streaming into the turtle.
+
+    Both sides build the same Geometry, which is included in the peaks.
+    """
+    print("streaming: modules, stored MB, streamed MB, streamed ms")
+
+    def stored(grappe, n_iter):
+        grappe.iterate(n_iter)
+        return draw(grappe.instructions), len(grappe.instructions)
+
+    for m, ns in sizes:
+        grappe = GrapeLSystem(m=m, ns=[ns]*(m-1))
+        (reference, n_modules), stored_peak = peak_memory(stored, grappe, None)
+        result, streamed_peak = peak_memory(grappe.stream_geometry, None)
+        _, elapsed = timed(grappe.stream_geometry, None)
+        assert (reference.edges == result.edges).all()
+        print(f"{n_modules:>10} {stored_peak/2**20:>10.1f} {streamed_peak/2**20:>10.1f} {elapsed*1000:>10.1f}")
+
+
+def bench_state_stack(pairs=200000, depth=8):
+    """Push/pop throughput of StateStack against deep-copying the turtle."""
+    print("state stack: push/pop pairs per second, deepcopy vs StateStack")
+    turtle = Turtle()
+
+    def deepcopy_pairs():
+        stack = []
+        for k in range(pairs // depth):
+            for d in range(depth):
+                stack.append([d, deepcopy(turtle)])
+            for d in range(depth):
+                vertex, saved = stack.pop()
+
+    def state_stack_pairs():
+        stack = StateStack()
+        for k in range(pairs // depth):
+            for d in range(depth):
+                stack.push(turtle.transform, d)
+            for d in range(depth):
+                vertex = stack.pop(turtle.transform)
+
+    _, slow = timed(deepcopy_pairs)
+    _, fast = timed(state_stack_pairs)
+    print(f"{pairs/slow:>12.0f} {pairs/fast:>12.0f} {slow/fast:>8.1f}")
+
+
+def skinned_faces(vertices, edges):
+    """Build the Skin + Subdivision branches and evaluate their final mesh."""
+    obj = object_from_arrays("skin", vertices, edges)
+    add_skin(obj)
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    return len(obj.evaluated_get(depsgraph).to_mesh().polygons)
+
+
+def bench_branch_meshes(sizes=((20, 15), (60, 45), (120, 100)), radius=0.025, resolution=8):
+    print("branch meshes: segments, tube ms, faces, blender tube ms, skin ms, skin faces")
+    for m, ns in sizes:
+        geometry = derived_cluster(m, ns).geometry()
+        tubes, fast = timed(tube_mesh, geometry.vertices, geometry.edges, radius, resolution)
+        line = f"{len(geometry.edges):>10} {fast*1000:>10.1f} {len(tubes.faces):>10}"
+        if in_blender():
+            _, build = timed(draw_tubes, "tubes", geometry.vertices, geometry.edges, radius, resolution)
+            faces, slow = timed(skinned_faces, geometry.vertices, geometry.edges)
+            line += f" {build*1000:>10.1f} {slow*1000:>10.1f} {faces:>10}"
+        print(line)
+
+
+def bench_lod(m=120, ns=100, radius=0.025, presets=(("high", HIGH), ("medium", MEDIUM), ("low", LOW))):
+    """Branch build time and face count of one cluster at every preset.
+
+    Berry faces are counted as the ``segments * rings`` of a UV sphere.
+    """
+    print("lod: preset, tube ms, tube faces, berry faces")
+    grappe = derived_cluster(m, ns)
+    for name, lod in presets:
+        geometry = grappe.geometry(pedicels=lod.pedicels)
+        tubes, elapsed = timed(tube_mesh, geometry.vertices, geometry.edges, radius, lod.resolution)
+        berries = len(geometry.finitions) * lod.segments * lod.rings
+        print(f"{name:>10} {elapsed*1000:>10.1f} {len(tubes.faces):>10} {berries:>10}")
+
+
+def bench_berries(m=60, ns=45, diameter=0.05, presets=(("high", HIGH), ("medium", MEDIUM), ("low", LOW))):
+    """Merged berry mesh of one cluster at every preset, from the cached sphere template."""
+    print("berries: preset, berries, array ms, vertices, blender ms")
+    geometry = derived_cluster(m, ns).geometry()
+    points = geometry.vertices[geometry.finitions]
+    for name, lod in presets:
+        spheres, elapsed = timed(sphere_mesh, points, diameter, lod.segments, lod.rings)
+        line = f"{name:>10} {len(points):>10} {elapsed*1000:>10.1f} {len(spheres.vertices):>10}"
+        if in_blender():
+            _, build = timed(merged_spheres, "berries", points, diameter, lod.segments, lod.rings)
+            line += f" {build*1000:>10.1f}"
+        print(line)
+
+
+def mean_overlap(points, radius):
+    i, j = neighbour_pairs(points, 2*radius)
+    return (2*radius - np.linalg.norm(points[i] - points[j], axis=1)).sum() / len(points) / radius
+
+
+def bench_relax(sizes=(10**3, 10**4, 10**5), radius=0.05, density=2.0, iterations=4):
+    """Berries relaxed per second, random berries with ``density`` neighbours on average.
+
+    Overlap is the summed sphere overlap per berry, relative to the radius.
+    """
+    print("relax: berries, berries/s per pass, overlap before, after")
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        side = (n * 4/3 * np.pi * (2*radius)**3 / density) ** (1/3)
+        points = rng.random((n, 3)) * side
+        relaxed, elapsed = timed(relax, points, radius, iterations)
+        before, after = mean_overlap(points, radius), mean_overlap(relaxed, radius)
+        print(f"{n:>10} {n*iterations/elapsed:>12.0f} {before:>10.3f} {after:>10.3f}")
+
+
+def bench_occlusion(shells=(3, 5, 8), m=20, ns=15, radii=(0.5, 1.0)):
+    """Buried berries culled from close-packed balls ``shells`` berries deep and from one cluster.
+
+    The cluster berries are relaxed at every radius of ``radii``: at the
+    drawers' default of 0.5 they are too sparse for any to be buried, and
+    culling only pays once berries are large against the internodes.
+    Faces are the high preset berry faces left after culling.
+    """
+    print("occlusion: berries, radius, culled, ms, faces kept")
+    radius = radii[0]
+    clouds = []
+    for n in shells:
+        # face centred cubic packing of touching berries, cut to a ball
+        k = int(n * np.sqrt(2))
+        cells = np.mgrid[-k:k+1, -k:k+1, -k:k+1].reshape(3, -1).T
+        cells = cells[(cells.sum(axis=1) % 2 == 0) & (np.linalg.norm(cells, axis=1) <= n * np.sqrt(2))]
+        clouds.append((f"ball {n}", cells * radius * np.sqrt(2), radius))
+    geometry = derived_cluster(m, ns).geometry()
+    for r in radii:
+        clouds.append((f"{m}/{ns}", relax(geometry.vertices[geometry.finitions], r), r))
+
+    faces = HIGH.segments * HIGH.rings
+    for name, points, r in clouds:
+        hidden, elapsed = timed(occluded, points, r)
+        kept = len(points) - hidden.sum()
+        print(f"{name:>10} {len(points):>8} {r:>6} {hidden.sum():>8} {elapsed*1000:>8.1f} {kept*faces:>10}")
+
+
+def bench_vineyard(count=400, workers=None):
+    """Clusters per second built serially and with 1, 2, 4... worker processes."""
+    print("vineyard: workers, clusters/s, speedup over serial")
+    specs = random_specs(count)
+    _, serial = timed(lambda: [build_cluster(spec) for spec in specs])
+    print(f"{'serial':>10} {count/serial:>10.1f} {1:>8.1f}")
+    for n in workers or [2**k for k in range((os.cpu_count() or 1).bit_length())]:
+        _, elapsed = timed(generate, specs, n)
+        print(f"{n:>10} {count/elapsed:>10.1f} {serial/elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    bench_rewriting()
+    bench_expansion()
+    bench_interpretation()
+    bench_streaming()
+    bench_state_stack()
+    bench_branch_meshes()
+    bench_lod()
+    bench_berries()
+    bench_relax()
+    bench_occlusion()
+    bench_vineyard()
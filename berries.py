@@ -0,0 +1,283 @@
+"""
+Berry attachment points collected while a cluster is drawn.
+
+Drawers used to rebuild a Python list of finition vertices on every ``S``
+module; ``BerryBuffer`` appends the coordinates to an amortized N x 3 array
+instead, so berry placement and export read one array directly.
+
+Berry meshes are copies of one UV sphere: ``sphere_template`` builds the
+topology once per resolution and ``sphere_mesh`` broadcasts it over the
+berry points.
+
+``relax`` pushes overlapping berries apart, finding close pairs with a
+uniform grid (``neighbour_pairs``) so each pass is linear on average.
+``occluded`` uses the same grid to find the berries buried inside a
+cluster, which never need a full-resolution mesh.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+
+SphereMesh = namedtuple("SphereMesh", "vertices, faces, face_sizes")
+
+# half of the 26 neighbour cells, so each pair of cells is visited once
+HALF_NEIGHBOURS = np.array([
+    (i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1) if (i, j, k) > (0, 0, 0)
+])
+
+
+class BerryBuffer:
+    """Amortized N x 3 buffer of berry points in drawing order.
+
+    ``indices`` keeps the vertex each berry hangs from, -1 when the drawer
+    has no vertex index for it. Capacity doubles when the buffer is full.
+    """
+
+    def __init__(self, capacity=64):
+        self._points = np.empty((capacity, 3))
+        self._indices = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def points(self):
+        return self._points[:self.size]
+
+    @property
+    def indices(self):
+        return self._indices[:self.size]
+
+    def reserve(self, size):
+        capacity = len(self._indices)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        points = np.empty((capacity, 3))
+        indices = np.empty(capacity, dtype=np.int64)
+        points[:self.size] = self.points
+        indices[:self.size] = self.indices
+        self._points, self._indices = points, indices
+
+    def extend(self, points, indices=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        end = self.size + len(points)
+        self.reserve(end)
+        self._points[self.size:end] = points
+        self._indices[self.size:end] = -1 if indices is None else indices
+        self.size = end
+
+    def append(self, point, index=-1):
+        self.extend((point,), (index,))
+
+    def relaxed(self, radius, iterations=4):
+        """The berry points with their overlaps resolved, see ``relax``.
+
+        The buffer keeps the points as drawn, so relaxing again for another
+        draw starts from the same positions.
+        """
+        return relax(self.points, radius, iterations)
+
+
+@lru_cache(maxsize=None)
+def sphere_template(segments=32, rings=16):
+    """Unit UV sphere with the topology of ``bmesh.ops.create_uvsphere``.
+
+    Poles on the z axis, ``rings - 1`` rings of ``segments`` vertices,
+    triangles around the poles and quads elsewhere, all facing outward.
+    ``faces`` is the flat list of face corners; vertices are float32 and
+    indices int32, as Blender stores them. Arrays are cached per resolution and shared,
+    so they are read-only.
+    """
+    theta = np.pi * np.arange(1, rings) / rings
+    phi = 2 * np.pi * np.arange(segments) / segments
+    ring = np.stack(np.broadcast_arrays(
+        np.sin(theta)[:, None] * np.cos(phi),
+        np.sin(theta)[:, None] * np.sin(phi),
+        np.cos(theta)[:, None],
+    ), axis=-1).reshape(-1, 3)
+    vertices = np.concatenate([[(0, 0, 1)], ring, [(0, 0, -1)]]).astype(np.float32)
+
+    j = np.arange(segments)
+    jn = (j + 1) % segments
+    top, bottom = 0, len(vertices) - 1
+    starts = 1 + segments * np.arange(rings - 1)
+    a, b = starts[:-1, None], starts[1:, None]
+    last = starts[-1]
+    faces = np.concatenate([
+        np.stack(np.broadcast_arrays(top, 1 + j, 1 + jn), axis=-1).ravel(),
+        np.stack(np.broadcast_arrays(a + j, b + j, b + jn, a + jn), axis=-1).ravel(),
+        np.stack(np.broadcast_arrays(last + j, bottom, last + jn), axis=-1).ravel(),
+    ]).astype(np.int32)
+    face_sizes = np.concatenate([
+        np.full(segments, 3), np.full(segments * (rings - 2), 4), np.full(segments, 3),
+    ]).astype(np.int32)
+    for array in (vertices, faces, face_sizes):
+        array.flags.writeable = False
+    return SphereMesh(vertices, faces, face_sizes)
+
+
+def sphere_mesh(points, diameter=0.5, segments=32, rings=16):
+    """One mesh of a sphere at every point, scaled and translated template copies.
+
+    ``diameter`` is a scalar or one value per point. Like the ``diameter``
+    of ``create_uvsphere`` it is the distance from center to surface.
+    """
+    template = sphere_template(segments, rings)
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    scale = np.broadcast_to(np.asarray(diameter, dtype=np.float32), len(points))
+
+    vertices = points[:, None, :] + scale[:, None, None] * template.vertices
+    offsets = np.arange(len(points), dtype=np.int32)[:, None] * np.int32(len(template.vertices))
+    return SphereMesh(
+        vertices.reshape(-1, 3),
+        (template.faces + offsets).ravel(),
+        np.tile(template.face_sizes, len(points)),
+    )
+
+
+def expand(rows, starts, counts):
+    """Pairs ``(row, starts[k] + c)`` for every ``c < counts[k]``."""
+    total = counts.sum()
+    first = np.cumsum(counts) - counts
+    within = np.arange(total) - np.repeat(first, counts)
+    return np.repeat(rows, counts), np.repeat(starts, counts) + within
+
+
+def neighbour_pairs(points, distance):
+    """Index pairs ``(i, j)``, ``i != j``, of points closer than ``distance``.
+
+    Points are hashed into a grid of ``distance`` cells, sorted by cell,
+    and every cell is matched with itself and 13 neighbours, so the cost
+    is linear in the number of points for a bounded density. No pair is
+    closer than a ``distance`` of zero or less.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) < 2 or not distance > 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    cells = np.floor(points / distance).astype(np.int64)
+    cells -= cells.min(axis=0) - 1          # a free layer of cells all around
+    shape = cells.max(axis=0) + 2
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    keys = cells @ strides
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    rows = np.arange(len(keys))
+
+    # same cell, later entries only
+    end = np.searchsorted(keys, keys, side="right")
+    a, b = expand(rows, rows + 1, end - rows - 1)
+    i, j = [a], [b]
+    for offset in HALF_NEIGHBOURS @ strides:
+        start = np.searchsorted(keys, keys + offset, side="left")
+        end = np.searchsorted(keys, keys + offset, side="right")
+        a, b = expand(rows, start, end - start)
+        i.append(a)
+        j.append(b)
+    i, j = order[np.concatenate(i)], order[np.concatenate(j)]
+
+    close = np.einsum("ij,ij->i", points[i] - points[j], points[i] - points[j]) < distance * distance
+    return i[close], j[close]
+
+
+def relax(points, radius, iterations=4):
+    """Berry centers moved so spheres of ``radius`` stop interpenetrating.
+
+    Each pass pushes every overlapping pair apart by half their overlap
+    along the line between the centers; a few passes settle dense
+    clusters. ``radius`` is a scalar or one value per point; returns a
+    new (N, 3) array.
+    """
+    points = np.array(points, dtype=np.float64).reshape(-1, 3)
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), len(points))
+    if not len(points):
+        return points
+
+    for _ in range(iterations):
+        i, j = neighbour_pairs(points, 2 * radius.max())
+        gap = points[j] - points[i]
+        length = np.linalg.norm(gap, axis=1)
+        overlap = radius[i] + radius[j] - length
+        keep = overlap > 0
+        if not keep.any():
+            break
+        i, j, gap, length, overlap = i[keep], j[keep], gap[keep], length[keep], overlap[keep]
+        # coincident berries are split along x
+        gap[length == 0] = (1, 0, 0)
+        length[length == 0] = 1
+        push = gap * (overlap / length / 2)[:, None]
+
+        for axis in range(3):
+            points[:, axis] += (np.bincount(j, push[:, axis], minlength=len(points))
+                                - np.bincount(i, push[:, axis], minlength=len(points)))
+    return points
+
+
+@lru_cache(maxsize=None)
+def sphere_directions(samples=48):
+    """``samples`` unit vectors evenly spread over the sphere (Fibonacci lattice)."""
+    k = np.arange(samples) + 0.5
+    z = 1 - 2 * k / samples
+    r = np.sqrt(1 - z * z)
+    phi = np.pi * (3 - np.sqrt(5)) * k
+    directions = np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=-1)
+    directions.flags.writeable = False
+    return directions
+
+
+def occluded(points, radius, reach=6.0, samples=128, cover=0.9, crowd=12):
+    """Mask of the berries hidden in every direction by their neighbours.
+
+    Only berries with at least ``crowd`` neighbours within 3 radii can be
+    buried; for those, rays leave the center along ``samples`` directions
+    and a neighbour closer than ``reach`` radii blocks the rays inside
+    ``cover`` of its apparent disc, leaving the slits between touching
+    berries open. A berry whose rays are all blocked cannot be seen from
+    outside the cluster, up to the gaps between sampled rays.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), len(points))
+    hidden = np.zeros(len(points), dtype=bool)
+    if not len(points):
+        return hidden
+
+    # berries on a lattice sit exactly 3 or ``reach`` radii apart, where
+    # rounding alone would decide whether they count
+    slack = 1 + 1e-6
+    i, j = neighbour_pairs(points, 3 * radius.max() * slack)
+    counts = np.bincount(i, minlength=len(points)) + np.bincount(j, minlength=len(points))
+    candidates = counts >= crowd
+    if not candidates.any():
+        return hidden
+
+    i, j = neighbour_pairs(points, reach * radius.max() * slack)
+    i, j = np.concatenate([i, j]), np.concatenate([j, i])
+    keep = candidates[i] & np.any(points[i] != points[j], axis=1)
+    order = np.argsort(i[keep], kind="stable")
+    i, j = i[keep][order], j[keep][order]
+    gap = points[j] - points[i]
+    length = np.linalg.norm(gap, axis=1)
+
+    # cosine of the half angle the neighbour covers, seen from the center
+    sine = np.minimum(cover * radius[j] / length, 1)
+    limit = np.sqrt(1 - sine * sine).astype(np.float32)
+    heading = (gap / length[:, None]).astype(np.float32)
+    directions = sphere_directions(samples).astype(np.float32)
+
+    # blocked rays as bits, or-ed over the contiguous run of pairs of each berry
+    berries, starts = np.unique(i, return_index=True)
+    covered = np.zeros((len(berries), (samples + 7) // 8), dtype=np.uint8)
+    bounds = np.append(starts, len(i))
+    step = max(1, (1 << 16) * len(berries) // len(i))
+    for first in range(0, len(berries), step):
+        last = min(first + step, len(berries))
+        lo, hi = bounds[first], bounds[last]
+        blocked = np.packbits(heading[lo:hi] @ directions.T > limit[lo:hi, None], axis=1)
+        covered[first:last] = np.bitwise_or.reduceat(blocked, starts[first:last] - lo)
+    full = np.packbits(np.ones(samples, dtype=bool))
+    hidden[berries] = (covered == full).all(axis=1)
+    return hidden
@@ -0,0 +1,178 @@
+"""
+Thin bridge from NumPy geometry to Blender meshes.
+
+The rest of the pipeline runs on plain CPython. This is the only module that
+needs ``bpy``, and it only touches it when a mesh is actually created.
+"""
+import numpy as np
+
+from berries import occluded, sphere_mesh, sphere_template
+from tubes import tube_mesh
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+def in_blender():
+    return bpy is not None
+
+
+def camera_distance(point, camera=None):
+    """Distance from ``point`` to ``camera``, the scene camera by default.
+
+    Without any camera the distance is 0, the closest level of detail.
+    """
+    if camera is None:
+        camera = bpy.context.scene.camera
+    if camera is None:
+        return 0.0
+    return float(np.linalg.norm(np.asarray(camera.matrix_world.translation) - np.asarray(point)))
+
+
+def mesh_from_arrays(name, vertices, edges=None, faces=None, face_sizes=None, smooth=False):
+    """Create a mesh datablock from NumPy arrays with ``foreach_set``.
+
+    ``vertices`` is (N, 3) and ``edges`` (E, 2). ``faces`` is either an
+    (F, k) array of vertex indices or, with ``face_sizes``, the flat list of
+    face corners with the corner count of every face.
+    """
+    if bpy is None:
+        raise RuntimeError("mesh_from_arrays needs to run inside Blender")
+
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", vertices.ravel())
+
+    if edges is not None and len(edges):
+        edges = np.ascontiguousarray(edges, dtype=np.int32)
+        mesh.edges.add(len(edges))
+        mesh.edges.foreach_set("vertices", edges.ravel())
+
+    if faces is not None and len(faces):
+        faces = np.asarray(faces, dtype=np.int32)
+        if face_sizes is None:
+            face_sizes = np.full(len(faces), faces.shape[1], dtype=np.int32)
+        face_sizes = np.asarray(face_sizes, dtype=np.int32)
+        mesh.loops.add(faces.size)
+        mesh.loops.foreach_set("vertex_index", faces.ravel())
+        mesh.polygons.add(len(face_sizes))
+        mesh.polygons.foreach_set("loop_start", np.cumsum(face_sizes) - face_sizes)
+        if bpy.app.version < (4, 0, 0):
+            mesh.polygons.foreach_set("loop_total", face_sizes)
+        if smooth:
+            mesh.polygons.foreach_set("use_smooth", np.ones(len(face_sizes), dtype=bool))
+
+    mesh.update(calc_edges=faces is not None)
+    return mesh
+
+
+def link_object(name, mesh, collection=None):
+    obj = bpy.data.objects.new(name, mesh)
+    if collection is None:
+        collection = bpy.context.collection
+    collection.objects.link(obj)
+    return obj
+
+
+def object_from_arrays(name, vertices, edges=None, collection=None):
+    """Create a mesh object from arrays and link it to ``collection``."""
+    mesh = mesh_from_arrays(name, vertices, edges)
+    return link_object(name, mesh, collection)
+
+
+def draw_tubes(name, vertices, edges, radius=0.025, resolution=8, collection=None):
+    """Mesh a branch skeleton as smooth-shaded tubes, with no modifiers."""
+    tubes = tube_mesh(vertices, edges, radius, resolution)
+    mesh = mesh_from_arrays(name, tubes.vertices, faces=tubes.faces, smooth=True)
+    return link_object(name, mesh, collection)
+
+
+def instance_spheres(name, points, diameter=0.5, segments=32, rings=16, collection=None):
+    """Show one shared sphere at every point through vertex instancing.
+
+    Only two objects are created, a points mesh and the sphere parented to
+    it, whatever the number of points.
+    """
+    points_obj = object_from_arrays(name, points, collection=collection)
+    points_obj.instance_type = 'VERTS'
+
+    template = sphere_template(segments, rings)
+    sphere = mesh_from_arrays(f"{name}_sphere", template.vertices * diameter, faces=template.faces,
+                              face_sizes=template.face_sizes, smooth=True)
+    sphere_obj = link_object(f"{name}_sphere", sphere, collection)
+    sphere_obj.parent = points_obj
+    return points_obj
+
+
+def merged_spheres(name, points, diameter=0.5, segments=32, rings=16, collection=None):
+    """Build all spheres as one mesh, copies of the cached sphere template.
+
+    ``diameter`` may also give one size per point.
+    """
+    spheres = sphere_mesh(points, diameter, segments, rings)
+    mesh = mesh_from_arrays(name, spheres.vertices, faces=spheres.faces, face_sizes=spheres.face_sizes, smooth=True)
+    return link_object(name, mesh, collection)
+
+
+def draw_spheres(name, points, diameter=0.5, segments=32, rings=16, mode="instances", collection=None):
+    """Add spheres at ``points`` as ``"instances"`` of one sphere or one ``"merged"`` mesh."""
+    if mode == "instances":
+        return instance_spheres(name, points, diameter, segments, rings, collection)
+    if mode == "merged":
+        return merged_spheres(name, points, diameter, segments, rings, collection)
+    raise ValueError(f"Unknown berry mode '{mode}'")
+
+
+def draw_culled_spheres(name, points, diameter=0.5, segments=32, rings=16, mode="instances", cull="drop",
+                        low=(6, 3), collection=None):
+    """``draw_spheres`` for the berries that are not buried inside the cluster.
+
+    Buried berries (``berries.occluded``) are left out with ``cull="drop"``
+    or drawn as a separate object of ``low`` (segments, rings) spheres with
+    ``cull="low"``. Returns the objects and the number of buried berries.
+    """
+    if cull not in ("drop", "low"):
+        raise ValueError(f"Unknown cull mode '{cull}'")
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    hidden = occluded(points, diameter)
+
+    objects = [draw_spheres(name, points[~hidden], diameter, segments, rings, mode, collection)]
+    if cull == "low" and hidden.any():
+        objects.append(draw_spheres(f"{name}_hidden", points[hidden], diameter, *low, mode, collection))
+    return objects, int(hidden.sum())
+
+
+def draw_berries(name, berries, diameter=0.5, segments=32, rings=16, mode="instances", relax=4, cull=None,
+                 collection=None):
+    """Spheres at the points of a ``BerryBuffer``, after ``relax`` overlap passes.
+
+    With ``cull`` the buried berries are handled as in
+    ``draw_culled_spheres``. Returns the objects and the number of culled
+    berries, 0 without ``cull``.
+    """
+    points = berries.relaxed(diameter, relax) if relax else berries.points
+    if cull is None:
+        return [draw_spheres(name, points, diameter, segments, rings, mode, collection)], 0
+    return draw_culled_spheres(name, points, diameter, segments, rings, mode, cull, collection=collection)
+
+
+def add_skin(obj, size=0.1, levels=4):
+    """Give an edge mesh thickness with a Skin + Subdivision modifier stack.
+
+    Much slower to evaluate than ``draw_tubes``; kept for comparison.
+    """
+    bpy.context.view_layer.objects.active = obj
+    obj.select_set(True)
+    bpy.ops.object.modifier_add(type='SKIN')
+    bpy.ops.object.modifier_add(type='SUBSURF')
+    bpy.context.object.modifiers["Subdivision"].levels = levels
+
+    bpy.ops.object.editmode_toggle()
+    bpy.ops.mesh.select_all(action='SELECT')
+    bpy.ops.transform.skin_resize(value=(size, size, size), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True,
+                                  use_proportional_edit=True, proportional_edit_falloff='SMOOTH', proportional_size=0.564474, use_proportional_connected=False, use_proportional_projected=False)
+
+    bpy.ops.object.editmode_toggle()
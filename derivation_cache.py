@@ -0,0 +1,92 @@
+"""
+Memoized L-system derivations.
+
+A derivation only depends on the grammar parameters and on the number of
+rewriting steps, so ``DerivationCache`` keeps every level it is given
+under ``(grammar key, level)``: a finished derivation is returned as is,
+and a longer one resumes from the deepest level already known. Entries
+are evicted least recently used first, and can also be written to a
+directory of ``.npz`` files shared between runs and processes.
+
+An entry may also be a function returning the derivation, called the
+first time the level is read: levels a derivation only passes through
+are cached without being built.
+"""
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from rewriting import ModuleString
+
+
+class DerivationCache:
+    def __init__(self, maxsize=256, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.levels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def path(self, key, level):
+        digest = hashlib.sha1(repr((key, level)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.npz")
+
+    def get(self, key, level):
+        """The derivation of ``key`` after ``level`` steps, or None.
+
+        Cached ModuleStrings are shared, so they must not be modified.
+        """
+        modules = self.levels.get((key, level))
+        if modules is not None:
+            if callable(modules):
+                modules = self.levels[(key, level)] = modules()
+            self.levels.move_to_end((key, level))
+            return modules
+
+        if self.directory is not None and os.path.exists(self.path(key, level)):
+            with np.load(self.path(key, level)) as data:
+                modules = ModuleString()
+                modules.codes.frombytes(data["codes"].tobytes())
+                modules.params.frombytes(data["params"].astype(np.float32).tobytes())
+            self.store(key, level, modules)
+            return modules
+        return None
+
+    def resume(self, key, level):
+        """Deepest known ``(k, derivation)`` with ``k <= level``, ``(0, None)`` if none."""
+        for k in range(level, 0, -1):
+            modules = self.get(key, k)
+            if modules is not None:
+                self.hits += 1
+                return k, modules
+        self.misses += 1
+        return 0, None
+
+    def put(self, key, level, modules):
+        if self.directory is not None and callable(modules):
+            modules = modules()
+        self.store(key, level, modules)
+        if self.directory is not None:
+            # written aside and renamed, so readers never see a partial file
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".npz", delete=False) as file:
+                np.savez(file,
+                         codes=np.frombuffer(modules.codes, dtype=np.uint8),
+                         params=np.frombuffer(modules.params, dtype=np.float32))
+            os.replace(file.name, self.path(key, level))
+
+    def store(self, key, level, modules):
+        self.levels[(key, level)] = modules
+        self.levels.move_to_end((key, level))
+        while len(self.levels) > self.maxsize:
+            self.levels.popitem(last=False)
+
+    def clear(self):
+        self.levels.clear()
@@ -6,6 +6,8 @@ import math
 import mathutils
 from mathutils import Vector
 from random import randint, uniform, seed
+from berries import BerryBuffer
+from blender_mesh import draw_spheres
 
 
 seed(10)
@@ -58,35 +60,13 @@ def get_childs(bm, ret, n_gen=5):
 
 vertices_base = get_base(bm, ret)
 
-finitions = []
+finitions = BerryBuffer()
 for vert in vertices_base:
     ret = [vert]
     ret = get_childs(bm, ret)
-    finitions = [*finitions, *ret]
+    finitions.extend([v.co[:] for v in ret])
 
-grappes = []
-for i, vert in enumerate(finitions):
-    mesh = bpy.data.meshes.new(f'baie_{i}')
-
-
-    # Construct the bmesh sphere and assign it to the blender mesh.
-    bm_temp = bmesh.new()
-    bmesh.ops.create_uvsphere(bm_temp, u_segments=32, v_segments=16, diameter=0.03)
-    bmesh.ops.translate(
-        bm_temp,
-        verts=bm_temp.verts,
-        vec=vert.co.to_tuple()
-    )
-    
-    bm_temp.to_mesh(mesh)
-    bm_temp.free()
-
-    obj_grappe_temp = bpy.data.objects.new(f'baie_{i}', mesh)
-#    obj_grappe_temp.location = vert.co
-    bpy.context.collection.objects.link(obj_grappe_temp)
-    obj_grappe_temp.select_set(True)
-    bpy.ops.object.shade_smooth()
-    grappes.append(obj_grappe_temp)
+grappes = draw_spheres("baies", finitions.points, diameter=0.03, mode="merged")
 
 
 # Finish up, write the bmesh into a new mesh
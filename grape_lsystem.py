@@ -0,0 +1,202 @@
+"""
+Bracketed grape-cluster L-system with no Blender dependency.
+
+``GrapeLSystem`` derives a ModuleString from the axiom ``Ar(m,l)`` and
+turns it into NumPy vertex/edge arrays with the turtle of turtle_np; the
+Blender scripts only push those arrays into a mesh.
+"""
+import math
+from copy import copy
+from dataclasses import dataclass, field
+from functools import partial
+from typing import *
+
+import numpy as np
+
+from rewriting import Expansion, ModuleString, flatten, is_final, rewrite_modules, stream, F, PLUS, MINUS, SLASH, PUSH, POP, S, CUT, WIDTH, E, AR, AF, AE, AP
+from turtle_np import draw, draw_vectorized, pedicels
+
+
+@dataclass
+class GrapeLSystem:
+    m: int = 5
+    ns: List[int] = field(default_factory=list)
+    l: float = 1
+    rl: float = 1
+    rr: float = 0.75
+    alpha: float = 45
+    position_base = (0, 0, 0)
+    phi = 0
+    theta = 0
+    w = 0.1
+    lw = 1/6
+    predecessors = (AR, AF, AE, AP, E)
+
+    def production(self, code, params, out):
+        if code == E:
+            type, theta, l = params
+            out.append(PLUS, theta)
+            out.append(WIDTH, self.w)
+            out.append(F, l)
+
+            if type == 0:
+                return
+            # parameters are stored in single precision
+            if math.isclose(l, self.lw, rel_tol=1e-6):
+                out.append(CUT)
+            else:
+                out.append(S, self.l*self.rr)
+            return
+
+        i = int(params[0])
+
+        if code == AR or code == AF:
+            j = params[1]
+            if i == 1:
+                out.append(AE, int(j*self.rl))
+                return
+
+        if code == AR:
+            out.append(E, 0, 0, self.l)
+            out.append(PUSH)
+            out.append(SLASH)
+            out.append(SLASH)
+            out.append(AR, i-1, j*self.rl)
+            out.append(POP)
+            out.append(PUSH)
+            out.append(PLUS, self.alpha)
+            out.append(AF, self.ns[i-2], j*self.rl)
+            out.append(POP)
+
+        elif code == AF:
+            out.append(E, 0, 0, self.l)
+            out.append(PUSH)
+            out.append(SLASH)
+            out.append(SLASH)
+            out.append(AF, i-1, j*self.rl)
+            out.append(POP)
+            out.append(PUSH)
+            out.append(PLUS, self.alpha)
+            out.append(AE, j*self.rl)
+            out.append(POP)
+
+        elif code == AE:
+            out.append(E, 0, 0, self.l)
+            out.append(PUSH)
+            out.append(AP, int(i*self.rl))
+            out.append(POP)
+            out.append(PUSH)
+            out.append(PLUS, self.alpha)
+            out.append(AP, int(i*self.rl))
+            out.append(POP)
+            out.append(PUSH)
+            out.append(MINUS, self.alpha)
+            out.append(AP, int(i*self.rl))
+            out.append(POP)
+
+        else:
+            out.append(E, 1, 0, self.l)
+            out.append(S, int(self.l*self.rr))
+
+    def extract_rules(self, modules):
+        return rewrite_modules(modules, self.production, self.predecessors)
+
+    def grammar_key(self):
+        """Every parameter a derivation depends on, besides its length."""
+        return (self.m, tuple(self.ns), self.l, self.rl, self.rr, self.alpha, self.w, self.lw)
+
+    def axiom(self):
+        omega = ModuleString()
+        omega.append(AR, self.m, self.l)
+        return omega
+
+    def expand(self, n_iter: Optional[int] = 10, modules=None):
+        """Root of the shared expansion DAG of ``n_iter`` steps from ``modules``.
+
+        ``modules`` defaults to the axiom; ``n_iter=None`` expands until
+        nothing is left to rewrite.
+        """
+        if modules is None:
+            modules = self.axiom()
+        self.expansion = Expansion(self.production, self.predecessors)
+        return self.expansion.expand(modules, n_iter)
+
+    def iterate(self, n_iter: Optional[int] = 10, cache=None):
+        """Derive up to ``n_iter`` steps from the axiom ``Ar(m,l)``.
+
+        Identical modules are expanded once through ``expand``, and the
+        derivation stops at its fixed point: ``self.iterations`` is the
+        number of steps actually used, and ``n_iter=None`` runs until
+        nothing is left to rewrite. With a ``DerivationCache`` the
+        derivation resumes from the deepest level cached for this grammar,
+        and every new level is cached (``cache_levels``); a cached
+        derivation already at its fixed point is used as is.
+        """
+        level, omega = 0, None
+        if cache is not None and n_iter is not None:
+            key = self.grammar_key()
+            level, omega = cache.resume(key, n_iter)
+
+        done = omega is not None and (level == n_iter or is_final(omega, self.predecessors))
+        if not done:
+            if cache is None:
+                omega = flatten(self.expand(None if n_iter is None else n_iter - level, omega))
+                level += self.expansion.iterations
+            else:
+                level, omega = self.cache_levels(cache, level, omega, n_iter)
+        self.instructions = omega
+        self.iterations = level
+
+    def cache_levels(self, cache, level, modules, n_iter):
+        """Derive from ``modules`` at ``level`` up to ``n_iter`` or the fixed point, caching every level.
+
+        Only the last level is flattened; the ones in between are cached as
+        functions deriving them from the same ``Expansion``, whose nodes they
+        share. That expansion runs on a copy of the grammar taken with the
+        key, so later changes to this one cannot leak into cached levels.
+        Returns the last level and its derivation.
+        """
+        key = self.grammar_key()
+        grammar = copy(self)
+        grammar.ns = list(self.ns)
+        omega = flatten(grammar.expand(None if n_iter is None else n_iter - level, modules))
+        self.expansion = grammar.expansion
+        if modules is None:
+            modules = self.axiom()
+        steps = self.expansion.iterations
+        for k in range(1, steps):
+            cache.put(key, level + k, partial(self.expansion.derive, modules, k))
+        cache.put(key, level + steps, omega)
+        return level + steps, omega
+
+    def stream(self, n_iter: Optional[int] = 10):
+        """Modules of ``n_iter`` steps from the axiom, derived depth-first on demand."""
+        return stream(self.axiom(), self.production, self.predecessors, n_iter)
+
+    def stream_geometry(self, n_iter: Optional[int] = 10):
+        """``geometry`` of ``n_iter`` steps without ever holding the derivation.
+
+        The turtle interprets modules as ``stream`` derives them, so memory
+        is bounded by the derivation and bracket depths, plus the output.
+        """
+        return draw(self.stream(n_iter), self.position_base)
+
+    def geometry(self, pedicels=True):
+        """Vertices, edges and berry vertex indices of the last derivation.
+
+        With ``pedicels=False`` the berry stalk edges are left out; their
+        end vertices stay, so berries keep their place.
+
+        ``AP`` emits an ``S`` after its ``E(1, ...)``, which rewrites to a
+        second ``S`` on the same vertex; ``finitions`` keeps one berry per
+        vertex, in drawing order.
+        """
+        geometry = draw_vectorized(self.instructions, self.position_base)
+        _, first = np.unique(geometry.finitions, return_index=True)
+        geometry = geometry._replace(finitions=geometry.finitions[np.sort(first)])
+        if pedicels:
+            return geometry
+        return geometry._replace(edges=geometry.edges[~self.pedicels()])
+
+    def pedicels(self):
+        return pedicels(self.instructions)
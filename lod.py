@@ -0,0 +1,34 @@
+"""
+Level-of-detail presets for cluster geometry.
+
+A ``LOD`` sets the berry sphere resolution, the number of vertices around
+each branch tube and whether pedicels, the short stalk segments that end
+on a berry, are meshed at all. ``lod_for_distance`` picks the preset for a
+cluster from its distance to the camera.
+"""
+import math
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class LOD:
+    segments: int = 32
+    rings: int = 16
+    resolution: int = 8
+    pedicels: bool = True
+
+
+HIGH = LOD()
+MEDIUM = LOD(segments=12, rings=6, resolution=5)
+LOW = LOD(segments=6, rings=3, resolution=3, pedicels=False)
+
+# (farthest distance, preset), nearest first
+DISTANCES = ((10.0, HIGH), (40.0, MEDIUM), (math.inf, LOW))
+
+
+def lod_for_distance(distance, distances=DISTANCES):
+    """First preset whose distance bound is not below ``distance``."""
+    for bound, lod in distances:
+        if distance <= bound:
+            return lod
+    return distances[-1][1]
@@ -3,15 +3,252 @@ A simple l-system
 """
 from math			import radians
 from random			import random, seed
-from collections	import namedtuple
+from collections	import namedtuple, Counter, defaultdict
+from functools		import lru_cache
+from array			import array
+from time			import perf_counter
 
+import numpy as np
 from mathutils		import Vector,Matrix
 
 Quad   = namedtuple('Quad', 'pos, up, right, forward')
 Edge   = namedtuple('Edge', 'start, end, radius')
 BObject = namedtuple('BObject', 'name, pos, up, right, forward')
+SegmentTree = namedtuple('SegmentTree', 'parents, depths, local, radii, names')
+Segments = namedtuple('Segments', 'starts, ends, radii, frames, names')
+
+# operation codes of a compiled program
+ROTATE, SCALE, RADIUS, PUSH, POP, EDGE, QUAD, OBJECT, RANDOM, CALL = range(10)
+
+# one interpreted Edge, Quad or object; kind is EDGE, QUAD or OBJECT, frame
+# holds the forward, up and right columns and name indexes the name table
+RECORD = np.dtype([
+	('kind', 'u1'),
+	('start', 'f4', 3),
+	('end', 'f4', 3),
+	('radius', 'f4'),
+	('frame', 'f4', (3, 3)),
+	('name', 'i4'),
+	])
+
+# batched tropism for arrays of turtle frames
+
+def normalized(vectors):
+	norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+	return vectors / np.where(norms > 0, norms, 1)
+
+def skew(v):
+	"""
+	Cross product matrices of an (N, 3) array.
+	"""
+	k = np.zeros(v.shape[:-1] + (3, 3))
+	k[..., 0, 1], k[..., 0, 2], k[..., 1, 2] = -v[..., 2], v[..., 1], -v[..., 0]
+	return k - np.swapaxes(k, -1, -2)
+
+def rotation_difference(a, b):
+	"""
+	(N, 3, 3) shortest-arc rotations taking the directions a onto b,
+	as a.rotation_difference(b) does for one pair of mathutils vectors.
+	"""
+	a, b = normalized(a), normalized(b)
+	c = np.einsum('...i,...i', a, b)
+	k = skew(np.cross(a, b))
+	opposite = c < -1 + 1e-9
+	scale = 1 / np.where(opposite, 1, 1 + c)
+	r = np.identity(3) + k + k @ k * scale[..., None, None]
+
+	if opposite.any():
+		# half turn around any axis perpendicular to a
+		x = a[opposite]
+		axis = np.cross(x, np.where(np.abs(x[:, :1]) < 0.9, [[1., 0, 0]], [[0., 1, 0]]))
+		axis = normalized(axis)
+		r[opposite] = 2 * axis[:, :, None] * axis[:, None, :] - np.identity(3)
+	return r
+
+def tropism_rotations(forward, tropism, magnitude):
+	"""
+	Rotations Turtle.apply_tropism applies to frames heading along forward.
+	"""
+	tf = forward + np.asarray(tropism) * magnitude
+	return rotation_difference(tf, forward)
+
+def bend_frames(frames, tropism, magnitude):
+	"""
+	One tropism step on (N, 3, 3) frames whose columns are forward, up and
+	right.
+	"""
+	return tropism_rotations(frames[:, :, 0], tropism, magnitude) @ frames
+
+def levels(depths):
+	"""
+	Segment indices grouped by tree depth, shallowest first.
+	"""
+	order = np.argsort(depths, kind='stable')
+	bounds = np.searchsorted(depths[order], np.arange(depths.max(initial=-1) + 2))
+	return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def bend_exact(parents, depths, local, frame, position, tropism, magnitude):
+	"""
+	Frames and end points of a segment tree with one tropism step per
+	segment, as the turtle applies it, batched over each tree depth.
+
+	parents is the parent segment of every segment (-1 for the root),
+	local the (N, 3, 3) turn from the parent frame to the segment, and
+	frame and position the turtle state at the root.
+	"""
+	n = len(parents)
+	frames = np.empty((n + 1, 3, 3))
+	ends = np.empty((n + 1, 3))
+	frames[n], ends[n] = frame, position
+	parents = np.where(parents < 0, n, parents)
+	for level in levels(depths):
+		parent = parents[level]
+		pre = frames[parent] @ local[level]
+		if magnitude:
+			pre = bend_frames(pre, tropism, magnitude)
+		frames[level] = pre
+		ends[level] = ends[parent] + pre[:, :, 0]
+	return frames[:n], ends[:n]
+
+def scan(values, parents, combine, identity):
+	"""
+	Combine values down every root path, combine(ancestors, own), by
+	pointer doubling: O(log depth) batched steps instead of one per
+	tree depth.
+	"""
+	n = len(parents)
+	# index n stands for the root and holds the identity
+	jump = np.append(np.where(parents < 0, n, parents), n)
+	values = np.concatenate([values, identity[None]])
+	while (jump != n).any():
+		values = combine(values[jump], values)
+		jump = jump[jump]
+	return values[:n]
+
+def bend_approximate(parents, local, frame, position, tropism, magnitude):
+	"""
+	Frames and end points of a segment tree where the tropism turn of every
+	segment is taken from its heading without the bends of its ancestors,
+	then composed down the tree like the local turns. Close to bend_exact
+	for small magnitudes, without one step per tree depth.
+	"""
+	identity = np.identity(3)
+	frames = frame @ scan(local, parents, np.matmul, identity)
+	if magnitude:
+		turns = tropism_rotations(frames[:, :, 0], tropism, magnitude)
+		frames = scan(turns, parents, lambda ancestors, own: own @ ancestors, identity) @ frames
+	ends = scan(frames[:, :, 0], parents, np.add, np.zeros(3))
+	return frames, ends + position
+
+@lru_cache(maxsize=None)
+def local_rotation(angle, axis):
+	"""
+	Frozen rotation of the turtle frame around its own forward ('X'),
+	up ('Y') or right ('Z') axis, cached per angle.
+	"""
+	r = Matrix.Rotation(angle, 3, axis)
+	r.freeze()
+	return r
+
+@lru_cache(maxsize=None)
+def operations(angle):
+	"""
+	Map of the predefined terminals to (code, argument, symbol)
+	operations, with the rotations for the default angle prebuilt.
+	"""
+	return {
+		'+': (ROTATE, local_rotation(angle, 'Z'), '+'),
+		'-': (ROTATE, local_rotation(-angle, 'Z'), '-'),
+		'[': (PUSH, None, '['),
+		']': (POP, None, ']'),
+		'/': (ROTATE, local_rotation(angle, 'Y'), '/'),
+		'\\': (ROTATE, local_rotation(-angle, 'Y'), '\\'),
+		'<': (ROTATE, local_rotation(angle, 'X'), '<'),
+		'>': (ROTATE, local_rotation(-angle, 'X'), '>'),
+		'&': (RANDOM, 30, '&'),
+		'!': (SCALE, 1.1, '!'),
+		'@': (SCALE, 0.9, '@'),
+		'#': (RADIUS, 1.1, '#'),
+		'%': (RADIUS, 0.9, '%'),
+		'F': (EDGE, None, 'F'),
+		'Q': (QUAD, None, 'Q'),
+		}
+
+class Trace:
+	"""
+	Trace callback for Turtle.interpret: counts the operations run for
+	every terminal and the time they took.
+	"""
+
+	def __init__(self):
+		self.counts = Counter()
+		self.times = defaultdict(float)
+
+	def __call__(self, symbol, elapsed):
+		self.counts[symbol] += 1
+		self.times[symbol] += elapsed
+
+	def report(self):
+		"""
+		One line per terminal, the most time consuming first.
+		"""
+		lines = []
+		for symbol in sorted(self.times, key=self.times.get, reverse=True):
+			lines.append('%-12s %10d %10.3f ms' % (symbol, self.counts[symbol], self.times[symbol] * 1000))
+		return '\n'.join(lines)
+
+class Records:
+	"""
+	Growable buffers of turtle output, one RECORD per Edge, Quad or object,
+	with a table of the object names.
+	"""
+
+	def __init__(self):
+		self.floats = array('f')
+		self.kinds = array('B')
+		self.names = array('i')
+		self.table = {}
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def add(self, kind, start, end, radius, frame, name=None):
+		self.floats.extend(start[:] + end[:] + (radius,) + frame[0][:] + frame[1][:] + frame[2][:])
+		self.kinds.append(kind)
+		self.names.append(-1 if name is None else self.table.setdefault(name, len(self.table)))
+
+	def add_tuple(self, t, frame, radius):
+		"""
+		Record an Edge, Quad or BObject returned by a custom terminal.
+		"""
+		if isinstance(t, Edge):
+			self.add(EDGE, t.start, t.end, t.radius, frame)
+		elif isinstance(t, Quad):
+			self.add(QUAD, t.pos, t.pos, radius, Matrix((t.forward, t.up, t.right)).transposed())
+		elif isinstance(t, BObject):
+			self.add(OBJECT, t.pos, t.pos + t.forward, radius,
+					Matrix((t.forward, t.up, t.right)).transposed(), t.name)
+
+	def array(self):
+		"""
+		The records as one RECORD structured array, and the name table.
+		"""
+		records = np.empty(len(self), RECORD)
+		floats = np.frombuffer(self.floats, dtype=np.float32).reshape(-1, 16)
+		records['kind'] = self.kinds
+		records['start'] = floats[:, 0:3]
+		records['end'] = floats[:, 3:6]
+		records['radius'] = floats[:, 6]
+		records['frame'] = floats[:, 7:].reshape(-1, 3, 3)
+		records['name'] = self.names
+		return records, list(self.table)
 
 class Turtle:
+	"""
+	The turtle orientation is kept as one HLU frame matrix whose columns
+	are the forward, up and right vectors, so turning around one of its
+	own axes is a product with a fixed local rotation.
+	"""
 
 	def __init__(self,
 					tropism=(0,0,0),
@@ -20,16 +257,16 @@ class Turtle:
 					iseed=42 ):
 		self.tropism = Vector(tropism).normalized()
 		self.magnitude = tropismsize
-		self.forward = Vector((1,0,0))
-		self.up = Vector((0,0,1))
-		self.right = self.forward.cross(self.up)
+		forward = Vector((1,0,0))
+		up = Vector((0,0,1))
+		self.frame = Matrix((forward, up, forward.cross(up))).transposed()
 		self.stack = []
 		self.position = Vector((0,0,0))
 		self.angle = angle
 		self.radius = 0.1
 		self.__init_terminals()
 		seed(iseed)
-		
+
 	def __init_terminals(self):
 		"""
 		Initialize a map of predefined terminals.
@@ -51,134 +288,304 @@ class Turtle:
 			'F': self.term_edge,
 			'Q': self.term_quad,
 			# '{': self.term_object
-			}   
-	
+			}
+
+	@property
+	def forward(self):
+		return self.frame.col[0].copy()
+
+	@forward.setter
+	def forward(self, value):
+		self.frame.col[0] = value
+
+	@property
+	def up(self):
+		return self.frame.col[1].copy()
+
+	@up.setter
+	def up(self, value):
+		self.frame.col[1] = value
+
+	@property
+	def right(self):
+		return self.frame.col[2].copy()
+
+	@right.setter
+	def right(self, value):
+		self.frame.col[2] = value
+
 	def apply_tropism(self):
 		# tropism is a normalized vector
 		t = self.tropism * self.magnitude
-		tf=self.forward + t
+		tf=self.frame.col[0] + t
 		tf.normalize()
-		q = tf.rotation_difference(self.forward)
-		self.forward.rotate(q)
-		self.up.rotate(q)
-		self.right.rotate(q)
-		
+		q = tf.rotation_difference(self.frame.col[0])
+		self.frame = q.to_matrix() @ self.frame
+
+	def rotate(self, value, default, axis):
+		val = radians(value) if not value is None else default
+		self.frame @= local_rotation(val, axis)
+
 	def term_plus(self, value=None):
-		val = radians(value) if not value is None else self.angle
-		r = Matrix.Rotation(val, 4, self.right)
-		self.forward.rotate(r)
-		self.up.rotate(r)
-		
+		self.rotate(value, self.angle, 'Z')
+
 	def term_minus(self, value=None):
-		val = radians(value) if not value is None else self.angle
-		r = Matrix.Rotation(-val, 4, self.right)
-		self.forward.rotate(r)
-		self.up.rotate(r)
-		
+		self.rotate(None if value is None else -value, -self.angle, 'Z')
+
 	def term_amp(self, value=30):
+		# random angles are not worth caching
 		k = (random()-0.5) * value
-		self.term_plus(value=k)
+		self.frame @= Matrix.Rotation(radians(k), 3, 'Z')
 		k = (random()-0.5) * value
-		self.term_slash(value=k)
-		
+		self.frame @= Matrix.Rotation(radians(k), 3, 'Y')
+
 	def term_slash(self, value=None):
-		r = Matrix.Rotation(radians(value) if not value is None
-							else self.angle, 4, self.up)
-		self.forward.rotate(r)
-		self.right.rotate(r)
-		
+		self.rotate(value, self.angle, 'Y')
+
 	def term_backslash(self, value=None):
-		r = Matrix.Rotation(-radians(value) if not value is None
-							else -self.angle, 4, self.up)
-		self.forward.rotate(r)
-		self.right.rotate(r)
-		
+		self.rotate(None if value is None else -value, -self.angle, 'Y')
+
 	def term_less(self, value=None):
-		r = Matrix.Rotation(radians(value) if not value is None
-							else self.angle, 4, self.forward)
-		self.up.rotate(r)
-		self.right.rotate(r)
-		
+		self.rotate(value, self.angle, 'X')
+
 	def term_greater(self, value=None):
-		r = Matrix.Rotation(-radians(value) if not value is None
-							else -self.angle, 4, self.forward)
-		self.up.rotate(r)
-		self.right.rotate(r)
-		
+		self.rotate(None if value is None else -value, -self.angle, 'X')
+
 	def term_pop(self, value=None):
 		t = self.stack.pop()
-		(	self.forward,
-			self.up,
-			self.right,
+		(	self.frame,
 			self.position,
 			self.radius ) = t
-		
+
 	def term_push(self, value=None):
-		t = (	self.forward.copy(),
-				self.up.copy(),
-				self.right.copy(),
+		t = (	self.frame.copy(),
 				self.position.copy(),
 				self.radius )
 		self.stack.append(t)
-	
+
 	def term_expand(self, value=1.1):
-		self.forward *= value
-		self.up *= value
-		self.right *= value
-		
+		self.frame *= value
+
 	def term_shrink(self, value=0.9):
-		self.forward *= value
-		self.up *= value
-		self.right *= value
-		
+		self.frame *= value
+
 	def term_fatten(self, value=1.1):
 		self.radius *= value
-		
+
 	def term_slink(self, value=0.9):
 		self.radius *= value
-		
+
 	def term_edge(self, value=None):
 		s = self.position.copy()
 		self.apply_tropism()
-		self.position += self.forward
+		self.position += self.frame.col[0]
 		e = self.position.copy()
 		return Edge(start=s, end=e, radius=self.radius)
-	
+
 	def term_quad(self, value=0.5):
-		return Quad(pos=self.position,
+		return Quad(pos=self.position.copy(),
 					right=self.right,
 					up=self.up,
 					forward=self.forward )
-		
+
 	def term_object(self, value=None, name=None):
 		s = self.position.copy()
 		self.apply_tropism()
-		self.position += self.forward
+		self.position += self.frame.col[0]
 		return BObject(name=name,
 					pos=s,
 					right=self.right,
 					up=self.up,
 					forward=self.forward )
-		
-	def interpret(self, s):
+
+	def compile(self, s):
 		"""
-		interpret the iterable s, yield Quad, Edge or Object named tuples.
+		Translate the iterable s into a list of (code, argument, symbol)
+		operations.
+
+		Predefined terminals come from the operation table of the turtle
+		angle; other entries of self.terminals become CALL operations and
+		characters without a terminal are dropped.
 		"""
-		print('interpret:',s)
+		table = operations(self.angle)
+		program = []
 		name=''
 		for c in s:
-			t = None
-			print(c,name)
 			if c == '}':
-				t = self.term_object(name=name[1:])
+				program.append((OBJECT, name[1:], '{}'))
 				name=''
 			elif c == '{' or name != '':
 				name += c
-				continue
-			elif name != '':
-				continue
+			elif c in table:
+				program.append(table[c])
 			elif c in self.terminals:
-				t = self.terminals[c]()
-			print('yield',t)
-			if not t is None:
-				yield t
\ No newline at end of file
+				program.append((CALL, self.terminals[c], c))
+		return program
+
+	def run(self, program):
+		"""
+		Execute a compiled program, yield Quad, Edge or Object named tuples.
+		"""
+		for code, arg, symbol in program:
+			if code == ROTATE:
+				self.frame @= arg
+			elif code == EDGE:
+				yield self.term_edge()
+			elif code == PUSH:
+				self.stack.append((self.frame.copy(), self.position.copy(), self.radius))
+			elif code == POP:
+				self.frame, self.position, self.radius = self.stack.pop()
+			elif code == SCALE:
+				self.frame *= arg
+			elif code == RADIUS:
+				self.radius *= arg
+			elif code == OBJECT:
+				yield self.term_object(name=arg)
+			elif code == QUAD:
+				yield self.term_quad()
+			elif code == RANDOM:
+				self.term_amp(arg)
+			else:
+				t = arg()
+				if not t is None:
+					yield t
+
+	def run_arrays(self, program):
+		"""
+		Execute a compiled program into a RECORD structured array, return
+		it with the table of object names.
+		"""
+		records = Records()
+		for code, arg, symbol in program:
+			if code == ROTATE:
+				self.frame @= arg
+			elif code == EDGE:
+				s = self.position.copy()
+				self.apply_tropism()
+				self.position += self.frame.col[0]
+				records.add(EDGE, s, self.position, self.radius, self.frame)
+			elif code == PUSH:
+				self.stack.append((self.frame.copy(), self.position.copy(), self.radius))
+			elif code == POP:
+				self.frame, self.position, self.radius = self.stack.pop()
+			elif code == SCALE:
+				self.frame *= arg
+			elif code == RADIUS:
+				self.radius *= arg
+			elif code == OBJECT:
+				s = self.position.copy()
+				self.apply_tropism()
+				self.position += self.frame.col[0]
+				records.add(OBJECT, s, self.position, self.radius, self.frame, arg)
+			elif code == QUAD:
+				records.add(QUAD, self.position, self.position, self.radius, self.frame)
+			elif code == RANDOM:
+				self.term_amp(arg)
+			else:
+				t = arg()
+				if not t is None:
+					records.add_tuple(t, self.frame, self.radius)
+		return records.array()
+
+	def segment_tree(self, program):
+		"""
+		Walk a compiled program without moving the turtle into a
+		SegmentTree, one entry per F or object segment: its parent segment
+		(-1 for the root), its depth, the (N, 3, 3) local turn from the
+		parent frame, its radius and its object name (None for edges).
+
+		Random turns are drawn once, so the same tree can be bent again
+		for other tropism settings.
+		"""
+		parents, depths, radii, names = [], [], [], []
+		local = array('d')
+		identity = Matrix.Identity(3)
+		segment, depth, turn, radius = -1, 0, identity, self.radius
+		stack = []
+		for code, arg, symbol in program:
+			if code == ROTATE:
+				turn = turn @ arg
+			elif code == EDGE or code == OBJECT:
+				parents.append(segment)
+				depths.append(depth)
+				radii.append(radius)
+				names.append(arg)
+				for row in turn:
+					local.extend(row)
+				segment, depth, turn = len(parents) - 1, depth + 1, identity
+			elif code == PUSH:
+				stack.append((segment, depth, turn, radius))
+			elif code == POP:
+				segment, depth, turn, radius = stack.pop()
+			elif code == SCALE:
+				turn = turn * arg
+			elif code == RADIUS:
+				radius *= arg
+			elif code == RANDOM:
+				k = (random()-0.5) * arg
+				turn = turn @ Matrix.Rotation(radians(k), 3, 'Z')
+				k = (random()-0.5) * arg
+				turn = turn @ Matrix.Rotation(radians(k), 3, 'Y')
+			elif code != QUAD:
+				raise ValueError("terminal '%s' cannot be batched" % symbol)
+		return SegmentTree(np.array(parents, dtype=int), np.array(depths, dtype=int),
+				np.frombuffer(local).reshape(-1, 3, 3), np.array(radii), names)
+
+	def bend(self, tree, exact=True):
+		"""
+		Segments of a SegmentTree grown from the turtle frame and position
+		under its tropism: starts, ends, radii, (N, 3, 3) frames whose
+		columns are forward, up and right, and object names.
+
+		exact applies tropism at every step as run does, in one batch per
+		tree depth; otherwise the bends are approximated (see
+		bend_approximate), which is cheaper on deep trees.
+		"""
+		frame, position = np.array(self.frame), np.array(self.position)
+		tropism = np.array(self.tropism)
+		if exact:
+			frames, ends = bend_exact(tree.parents, tree.depths, tree.local,
+									frame, position, tropism, self.magnitude)
+		else:
+			frames, ends = bend_approximate(tree.parents, tree.local,
+									frame, position, tropism, self.magnitude)
+		starts = np.where((tree.parents < 0)[:, None], position, ends[tree.parents])
+		return Segments(starts, ends, tree.radii, frames, tree.names)
+
+	def run_batched(self, program, exact=True):
+		"""
+		Interpret the F and object segments of a compiled program at once
+		into Segments arrays. Quads are skipped and the turtle is left
+		unchanged.
+		"""
+		return self.bend(self.segment_tree(program), exact)
+
+	def run_traced(self, program, trace):
+		"""
+		run, calling trace(symbol, seconds) after every operation.
+		"""
+		for operation in program:
+			t0 = perf_counter()
+			out = list(self.run((operation,)))
+			trace(operation[2], perf_counter() - t0)
+			yield from out
+
+	def interpret_arrays(self, s):
+		"""
+		interpret the iterable s in one batch: a RECORD structured array
+		with one entry per Quad, Edge or Object, and the object name table.
+		"""
+		return self.run_arrays(self.compile(s))
+
+	def interpret(self, s, trace=None):
+		"""
+		interpret the iterable s, yield Quad, Edge or Object named tuples.
+
+		trace, a callable such as a Trace instance, is called with the
+		terminal and the time spent on it after every operation; without
+		it nothing is measured.
+		"""
+		program = self.compile(s)
+		if trace is None:
+			return self.run(program)
+		return self.run_traced(program, trace)
@@ -7,6 +7,8 @@ import mathutils
 from mathutils import Vector
 from random import randint, uniform, seed
 from time import time
+from berries import BerryBuffer
+from blender_mesh import draw_spheres
 # https://github.com/krljg/lsystem/
 
 
@@ -369,7 +371,7 @@ class GrapeLSystem:
         phi = self.phi
         theta = self.theta
 
-        self.finitions = []
+        self.finitions = BerryBuffer()
         internode = 0
         number_berries = 0
         while cursor < len(self.instructions):
@@ -395,7 +397,7 @@ class GrapeLSystem:
                 param = int(float(temp_string[2:].split(')')[0]))
                 phi -= param
             elif char == "S":
-                self.finitions = [*self.finitions, *verts]
+                self.finitions.extend([v.co[:] for v in verts])
                 number_berries += 1
 
             cursor += 1
@@ -403,30 +405,8 @@ class GrapeLSystem:
         print(f"Number berries : {number_berries}")
         pass
 
-    def draw_bairies(self):
-        grappes = []
-        for i, vert in enumerate(self.finitions):
-            mesh = bpy.data.meshes.new(f'baie_{vert.index}')
-
-            # Construct the bmesh sphere and assign it to the blender mesh.
-            bm_temp = bmesh.new()
-            bmesh.ops.create_uvsphere(
-                bm_temp, u_segments=32, v_segments=16, diameter=0.5)
-            print(self.mesh_branch.verts)
-            bmesh.ops.translate(
-                bm_temp,
-                verts=bm_temp.verts,
-                vec=vert.co.to_tuple()
-            )
-
-            bm_temp.to_mesh(mesh)
-            bm_temp.free()
-
-            obj_grappe_temp = bpy.data.objects.new(f'baie_{i}', mesh)
-            bpy.context.collection.objects.link(obj_grappe_temp)
-            obj_grappe_temp.select_set(True)
-            bpy.ops.object.shade_smooth()
-            grappes.append(obj_grappe_temp)
+    def draw_bairies(self, diameter=0.5, mode="merged"):
+        return draw_spheres("baies", self.finitions.points, diameter=diameter, mode=mode)
 
     def show(self):
         me = bpy.data.meshes.new("branches")
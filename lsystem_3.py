@@ -1,12 +1,17 @@
 from typing import *
+from array import array
 from dataclasses import dataclass, field
 import bpy
-import bmesh
 import math
 import mathutils
+import numpy as np
 from mathutils import Vector
 from random import randint, uniform, seed
 from time import time
+from rewriting import derive, iter_derivation, iter_modules, rewrite
+from berries import BerryBuffer
+from blender_mesh import camera_distance, draw_berries, draw_tubes, link_object, mesh_from_arrays
+from lod import HIGH, lod_for_distance
 # https://github.com/krljg/lsystem/
 
 
@@ -37,7 +42,7 @@ class Pen():
         pass
 
     def end(self):
-        """Return a mesh"""
+        """Close the current part"""
         return None
 
     def start_branch(self):
@@ -53,47 +58,61 @@ class Pen():
         return None
 
 
-class BMeshPen(Pen):
+class MeshBuffers:
+    """Vertices and faces shared by every pen of a BlObject, meshed once at the end."""
+
     def __init__(self):
+        self.vertices = array("d")
+        self.corners = array("i")
+        self.face_sizes = array("i")
+        self.materials = array("i")
+
+    def add_vertices(self, points):
+        """Append points, return their indices."""
+        start = len(self.vertices) // 3
+        for p in points:
+            self.vertices.extend(p)
+        return range(start, start + len(points))
+
+    def add_face(self, indices, material=None):
+        self.corners.extend(indices)
+        self.face_sizes.append(len(indices))
+        self.materials.append(material or 0)
+
+    def arrays(self):
+        """Vertex, flat face-corner, face-size and material index arrays."""
+        return (np.frombuffer(self.vertices).reshape(-1, 3),
+                np.frombuffer(self.corners, dtype=np.int32),
+                np.frombuffer(self.face_sizes, dtype=np.int32),
+                np.frombuffer(self.materials, dtype=np.int32))
+
+
+class BufferPen(Pen):
+    """Pen adding its vertices and faces straight to shared MeshBuffers."""
+
+    def __init__(self, buffers=None):
         Pen.__init__(self)
-        self.bmesh = None
+        self.buffers = buffers
         self.last_vertices = None
-        self.material = None
-        self.stack = []
-
-    def set_material(self, material):
-        self.material = material
-
-    def reset(self):
-        self.bmesh = bmesh.new()
         self.stack = []
 
     def start(self, trans_mat):
-        self.reset()
+        self.stack = []
         self.last_vertices = self.create_vertices(trans_mat)
 
     def move_and_draw(self, trans_mat):
         new_vertices = self.create_vertices(trans_mat)
-        new_faces = self.connect(self.last_vertices, new_vertices)
+        for face in self.connect(self.last_vertices, new_vertices):
+            self.buffers.add_face(face, self.material)
         self.last_vertices = new_vertices
 
-        if self.material is not None:
-            for f in new_faces:
-                f.material_index = self.material
-
     def move(self, trans_mat):
         self.last_vertices = self.create_vertices(trans_mat)
 
     def end(self):
-        """Return a mesh"""
-        if not self.stack:
-            if self.bmesh is None:  # end() can be called before start()
-                return None
-            mesh = bpy.data.meshes.new("lsystem.bmesh")
-            self.bmesh.to_mesh(mesh)
-            return mesh
-
-        self.last_vertices, self.radius, self.material = self.stack.pop()
+        """Close the current branch, if any. The faces are already in the buffers."""
+        if self.stack:
+            self.last_vertices, self.radius, self.material = self.stack.pop()
         return None
 
     def start_branch(self):
@@ -109,37 +128,51 @@ class BMeshPen(Pen):
         raise Exception("connect not implemented")
 
 
-class BLinePen(BMeshPen):
-    def __init__(self):
-        BMeshPen.__init__(self)
+class CylPen(BufferPen):
+    """Cylinders of ``vertices`` sides around the local z axis of the turtle."""
+
+    def __init__(self, vertices=4, buffers=None):
+        BufferPen.__init__(self, buffers)
+        angles = np.arange(vertices) * 2 * math.pi / vertices
+        self.circle = [Vector((math.cos(a), math.sin(a), 0)) for a in angles]
 
     def create_vertices(self, trans_mat):
-        v1 = self.bmesh.verts.new(util.matmul(
-            trans_mat, mathutils.Vector((self.radius, 0, 0))))
-        v2 = self.bmesh.verts.new(util.matmul(
-            trans_mat, mathutils.Vector((-self.radius, 0, 0))))
-        return [v1, v2]
+        return self.buffers.add_vertices([trans_mat @ (p * self.radius) for p in self.circle])
 
     def connect(self, last_vertices, new_vertices):
-        return [self.bmesh.faces.new((last_vertices[0], last_vertices[1], new_vertices[1], new_vertices[0]))]
+        n = len(new_vertices)
+        return [(last_vertices[i], last_vertices[(i + 1) % n], new_vertices[(i + 1) % n], new_vertices[i])
+                for i in range(n)]
+
+
+class BLinePen(BufferPen):
+    def create_vertices(self, trans_mat):
+        return self.buffers.add_vertices([
+            trans_mat @ Vector((self.radius, 0, 0)),
+            trans_mat @ Vector((-self.radius, 0, 0)),
+        ])
+
+    def connect(self, last_vertices, new_vertices):
+        return [(last_vertices[0], last_vertices[1], new_vertices[1], new_vertices[0])]
 
 
 class BlObject:
     def __init__(self, radius, name="lsystem"):
         self.stack = []
         self.radius = radius
-        self.pen = pen.CylPen(4)
+        self.name = name
+        self.buffers = MeshBuffers()
+        self.pen = CylPen(4, self.buffers)
         self.materials = []
-        self.bmesh = bmesh.new()
-        self.mesh = bpy.data.meshes.new(name)
-        self.object = bpy.data.objects.new(self.mesh.name, self.mesh)
         self.last_indices = []
 
     def set_pen(self, name, transform):
         self.end_mesh_part()
 
         if name == "line":
-            self.pen = BLinePen()
+            self.pen = BLinePen(self.buffers)
+        elif name == "cylinder":
+            self.pen = CylPen(4, self.buffers)
         else:
             print("No pen with name '"+name+"' found")
             return
@@ -148,8 +181,6 @@ class BlObject:
     def set_material(self, name):
         if name not in self.materials:
             self.materials.append(name)
-            mat = bpy.data.materials.get(name)
-            self.mesh.materials.append(mat)
         index = self.materials.index(name)
         self.pen.set_material(index)
 
@@ -174,9 +205,7 @@ class BlObject:
         if self.pen is not pen:
             self.end_mesh_part()
         self.pen = pen
-        mesh = self.pen.end_branch()
-        if mesh is not None:
-            self.bmesh.from_mesh(mesh)
+        self.pen.end_branch()
         return transform
 
     def is_new_mesh_part(self):
@@ -188,10 +217,7 @@ class BlObject:
         self.pen.start(transform)
 
     def end_mesh_part(self):
-        # pen.end() will return a mesh if it's really the end and not just a branch closing
-        new_mesh = self.pen.end()
-        if new_mesh is not None:
-            self.bmesh.from_mesh(new_mesh)
+        self.pen.end()
 
     def get_last_indices(self):
         return self.last_indices
@@ -199,18 +225,24 @@ class BlObject:
     def set_last_indices(self, indices):
         self.last_indices = indices
 
-    def finish(self, context):
-        # print("turtle.finish")
-        # print(str(self.pen))
-        new_mesh = self.pen.end()
-        if new_mesh is not None:
-            self.bmesh.from_mesh(new_mesh)
-
-        # me = bpy.data.meshes.new("lsystem")
-        self.bmesh.to_mesh(self.mesh)
-        base = util.link(context, self.object)
-
-        return self.object, base
+    def finish(self, context=None, collection=None):
+        """Build the one mesh of every pen's faces and link its object.
+
+        Returns ``(object, base)`` as before the pens wrote to buffers. ``base``
+        is always None: from Blender 2.80 on, linking gives no Base. The object
+        goes to ``collection``, else to the scene collection of ``context``
+        like util.link did, else to the active collection.
+        """
+        if collection is None and context is not None:
+            collection = context.scene.collection
+        self.pen.end()
+        vertices, corners, face_sizes, materials = self.buffers.arrays()
+        mesh = mesh_from_arrays(self.name, vertices, faces=corners, face_sizes=face_sizes)
+        for name in self.materials:
+            mesh.materials.append(bpy.data.materials.get(name))
+        if len(materials):
+            mesh.polygons.foreach_set("material_index", materials)
+        return link_object(self.name, mesh, collection), None
 
     def move_and_draw(self, transform):
         self.pen.move_and_draw(transform)
@@ -261,14 +293,13 @@ class Turtle:
     def set_direction(self, direction):
         self.direction = direction
         up = mathutils.Vector((0.0, 0.0, 1.0))
-        old_direction = util.matmul(self.transform, up)
+        old_direction = self.transform @ up
         quat = old_direction.rotation_difference(direction)
         rot_matrix = quat.to_matrix().to_4x4()
-        self.transform = util.matmul(self.transform, rot_matrix)
+        self.transform = self.transform @ rot_matrix
 
     def rotate(self, angle, vector):
-        self.transform = util.matmul(
-            self.transform, mathutils.Matrix.Rotation(angle, 4, vector))
+        self.transform = self.transform @ mathutils.Matrix.Rotation(angle, 4, vector)
 
     def rotate_y(self, angle):
         self.rotate(angle, mathutils.Vector((0.0, 1.0, 0.0)))
@@ -291,173 +322,129 @@ class GrapeLSystem:
     position_base = (0, 0, 0)
     phi = 0
     theta = 0
+    predecessors = ("Ar", "Af", "Ae", "Ap")
 
-    def extract_rules(self, string):
-        replacements = []
-        for k, c in enumerate(string):
-            if c == "A" and k < len(string)-1 and string[k+1] in ["r", "f", "e", "p"]:
-                next_string = string[k:].split(")")[0]
-                i = int(float(next_string[3:].split(',')[0]))
-
-                if string[k+1] != "e" and string[k+1] != "p":
-                    j = int((next_string[3:].split(',')[1]))
+    def production(self, name, args):
+        i = int(float(args.split(',')[0]))
 
-                if string[k+1] == "r":
-                    if i == 1:
-                        new_comand = f"Ae({int(j*self.rl)})"
-                    if i > 1:
-                        print(i)
-                        new_comand = f"F({j})[//Ar({i-1}, {int(j*self.rl)})][+({self.alpha})Af({self.ns[i-2]}, {int(j*self.rl)})]"
+        if name != "Ae" and name != "Ap":
+            j = int((args.split(',')[1]))
 
-                if string[k+1] == "f":
-                    if i > 1:
-                        new_comand = f"F({j})[//Af({i-1}, {int(j*self.rl)})][+({self.alpha})Ae({j*self.rl})]"
-                    if i == 1:
-                        new_comand = f"Ae({int(j*self.rl)})"
+        if name == "Ar":
+            if i == 1:
+                return f"Ae({int(j*self.rl)})"
+            return f"F({j})[//Ar({i-1}, {int(j*self.rl)})][+({self.alpha})Af({self.ns[i-2]}, {int(j*self.rl)})]"
 
-                if string[k+1] == "e":
-                    new_comand = f"F({i})[Ap({int(i*self.rl)})][+({self.alpha})Ap({int(i*self.rl)})][-({self.alpha})Ap({int(i*self.rl)})]"
+        if name == "Af":
+            if i == 1:
+                return f"Ae({int(j*self.rl)})"
+            return f"F({j})[//Af({i-1}, {int(j*self.rl)})][+({self.alpha})Ae({j*self.rl})]"
 
-                if string[k+1] == "p":
-                    new_comand = f"F({i})S({int(self.l*self.rr)})"
+        if name == "Ae":
+            return f"F({i})[Ap({int(i*self.rl)})][+({self.alpha})Ap({int(i*self.rl)})][-({self.alpha})Ap({int(i*self.rl)})]"
 
-                replacements.append([k, k + len(next_string), new_comand])
+        return f"F({i})S({int(self.l*self.rr)})"
 
-        decalage = 0
-
-        for replacement in replacements:
-            start, end, new_comand = replacement
-            length_diff = len(new_comand) - (end-start)
-
-            before = string[:max(0, start+decalage)]
-            after = string[min(end+decalage, len(string)):]
-
-            string = before + new_comand + after
-
-            decalage += length_diff
+    def extract_rules(self, string):
+        return rewrite(string, self.production, self.predecessors)
 
-        return string
+    def iterate(self, n_iter: Optional[int] = 10):
+        """Derive from ``Ar(m,l)``, stopping early once nothing is left to rewrite.
 
-    def iterate(self, n_iter: int = 10):
+        ``self.iterations`` is the number of steps actually used; with
+        ``n_iter=None`` the derivation runs until that fixed point.
+        """
         omega = f"Ar({self.m},{self.l})"
+        self.instructions, self.iterations = derive(omega, self.production, self.predecessors, n_iter)
 
-        for iteration in range(n_iter):
-            omega = self.extract_rules(omega)
-        self.instructions = omega
+    def stream(self, n_iter: Optional[int] = 10):
+        """Modules of the derivation, expanded depth-first as ``draw`` reads them."""
+        return iter_derivation(f"Ar({self.m},{self.l})", self.production, self.predecessors, n_iter)
 
     def draw_segment(self, state, length):
         verts, phi, theta = state
         phi = math.radians(phi)
         theta = theta
 
-        ret = bmesh.ops.extrude_vert_indiv(self.mesh_branch, verts=verts)
-
         x = length * math.sin(phi) * math.cos(theta)
         y = length * math.sin(phi) * math.sin(theta)
         z = - length * math.cos(phi)
 
-        ret['verts'][0].co += Vector([x, y, z])
+        ret = []
+        for v in verts:
+            co = self.vertices[v]
+            self.vertices.append((co[0] + x, co[1] + y, co[2] + z))
+            self.edges.append((v, len(self.vertices) - 1))
+            ret.append(len(self.vertices) - 1)
 
-        return ret['verts'], phi, theta
+        return ret, phi, theta
 
-    def draw(self):
-        cursor = 0
+    def draw(self, modules=None):
+        if modules is None:
+            modules = iter_modules(self.instructions)
         stack = []
-        self.mesh_branch = bmesh.new()
-        verts = [self.mesh_branch.verts.new(self.position_base)]
+        self.vertices = [tuple(self.position_base)]
+        self.edges = []
+        verts = [0]
 
         phi = self.phi
         theta = self.theta
 
-        self.finitions = []
+        self.finitions = BerryBuffer()
+        self.pedicels = []
         internode = 0
         number_berries = 0
-        while cursor < len(self.instructions):
-            char = self.instructions[cursor]
-            temp_string = self.instructions[cursor:]
-
-            if char == "F":
-                param = int(float(temp_string[2:].split(')')[0]))
+        previous = None
+        for name, params in modules:
+            if name == "F":
                 verts, phi, theta = self.draw_segment(
-                    [verts, phi, theta], param)
+                    [verts, phi, theta], int(params[0]))
                 internode += 1
-            elif char == "/" and self.instructions[cursor+1] != "(":
+            elif name == "/" and not params:
                 theta += 90
-            elif char == "[":
+            elif name == "[":
                 stack.append([verts, phi, theta])
-            elif char == "]":
+            elif name == "]":
                 verts, phi, theta = stack.pop()
 
-            elif char == "+":
-                param = int(float(temp_string[2:].split(')')[0]))
-                phi += param
-            elif char == "-":
-                param = int(float(temp_string[2:].split(')')[0]))
-                phi -= param
-            elif char == "S":
-                self.finitions = [*self.finitions, *verts]
+            elif name == "+":
+                phi += int(params[0])
+            elif name == "-":
+                phi -= int(params[0])
+            elif name == "S":
+                self.finitions.extend([self.vertices[v] for v in verts], verts)
                 number_berries += 1
+                if previous == "F":
+                    self.pedicels.extend(range(len(self.edges) - len(verts), len(self.edges)))
+            previous = name
 
-            cursor += 1
         print(f"Number internode : {internode}")
         print(f"Number berries : {number_berries}")
         pass
 
-    def draw_bairies(self):
-        grappes = []
-        for i, vert in enumerate(self.finitions):
-            mesh = bpy.data.meshes.new(f'baie_{vert.index}')
-
-            # Construct the bmesh sphere and assign it to the blender mesh.
-            bm_temp = bmesh.new()
-            bmesh.ops.create_uvsphere(
-                bm_temp, u_segments=32, v_segments=16, diameter=0.5)
-            print(self.mesh_branch.verts)
-            bmesh.ops.translate(
-                bm_temp,
-                verts=bm_temp.verts,
-                vec=vert.co.to_tuple()
-            )
-
-            bm_temp.to_mesh(mesh)
-            bm_temp.free()
-
-            obj_grappe_temp = bpy.data.objects.new(f'baie_{i}', mesh)
-            bpy.context.collection.objects.link(obj_grappe_temp)
-            obj_grappe_temp.select_set(True)
-            bpy.ops.object.shade_smooth()
-            grappes.append(obj_grappe_temp)
-
-    def show(self):
-        me = bpy.data.meshes.new("branches")
-        self.mesh_branch.to_mesh(me)
-#        self.mesh_branch.free()
-
-        # Add the mesh to the scene
-        obj = bpy.data.objects.new("branches", me)
-        bpy.context.collection.objects.link(obj)
-
-        # Select and make active
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
-        bpy.ops.object.modifier_add(type='SKIN')
-        bpy.ops.object.modifier_add(type='SUBSURF')
-        bpy.context.object.modifiers["Subdivision"].levels = 4
-
-        bpy.ops.object.editmode_toggle()
-        bpy.ops.mesh.select_all(action='SELECT')
-        size = 0.1
-        bpy.ops.transform.skin_resize(value=(size, size, size), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True,
-                                      use_proportional_edit=True, proportional_edit_falloff='SMOOTH', proportional_size=0.564474, use_proportional_connected=False, use_proportional_projected=False)
-
-        bpy.ops.object.editmode_toggle()
-
-
-ns = [2, 1]
-grappe = GrapeLSystem(m=3, ns=ns[::-1])
-t0 = time()
-grappe.iterate(n_iter=10)
-grappe.draw()
-grappe.draw_bairies()
-print(f"Time : {round((time()-t0)*1000)}ms")
-grappe.show()
+    def draw_bairies(self, diameter=0.5, mode="instances", lod=HIGH, relax=4, cull=None):
+        """Berries on the vertices collected by ``draw``, at ``lod`` resolution.
+
+        Returns the berry objects and the number of culled berries, see
+        ``blender_mesh.draw_berries``.
+        """
+        return draw_berries("baies", self.finitions, diameter, lod.segments, lod.rings, mode, relax, cull)
+
+    def show(self, radius=0.025, lod=HIGH):
+        edges = np.array(self.edges).reshape(-1, 2)
+        if not lod.pedicels:
+            edges = np.delete(edges, self.pedicels, axis=0)
+        return draw_tubes("branches", self.vertices, edges, radius, lod.resolution)
+
+
+if __name__ == "__main__":
+    ns = [2, 1]
+    grappe = GrapeLSystem(m=3, ns=ns[::-1])
+    lod = lod_for_distance(camera_distance(grappe.position_base))
+    t0 = time()
+    grappe.iterate(n_iter=10)
+    print(f"Number iterations : {grappe.iterations}")
+    grappe.draw()
+    grappe.draw_bairies(lod=lod)
+    print(f"Time : {round((time()-t0)*1000)}ms")
+    grappe.show(lod=lod)
@@ -1,9 +1,8 @@
 import bpy
-import bmesh
 import math
-import mathutils
-from mathutils import Vector
-from random import randint, uniform, seed
+import numpy as np
+from berries import BerryBuffer
+from blender_mesh import draw_berries, draw_tubes
 
 class Grape(object):
     
@@ -14,159 +13,88 @@ class Grape(object):
         self.mildiou_frequency = mildiou_frequency
         self.mildiou_intensity = mildiou_intensity
         self.number = number
-        self.finitions = []
+        self.vertices = np.empty((0, 3))
+        self.edges = np.empty((0, 2), dtype=np.int64)
+        self.finitions = BerryBuffer()
         
         for obj in bpy.data.objects:
             obj.select_set(False)
         
     def sigmoid(self, x, min_y, max_y, min_x, max_x, transform = lambda x : x):
-        return (max_y-min_y)/(1+math.exp(-(transform(x)-(min_x+max_x)/2)))+min_y
+        # tanh form of 1/(1+exp(-z)), no overflow on long rachis
+        return (max_y-min_y)*(1+np.tanh((transform(x)-(min_x+max_x)/2)/2))/2+min_y
     
     def distance_rachis(self, i):
         return self.sigmoid(self.number-i-1, 0.3, 1, 0,self.number+3)
     
     def distance_first_orders(self, i, rachis_index = 0):
-        return self.sigmoid(self.number-i-1, 0.2, uniform(0.7,1.3), 0, 5, transform=lambda x: x)
-        
-    def generate_rachis(self, distance_function = None, theta_bound = (-math.pi,math.pi), phi_bound = (-math.pi/16, math.pi/16)):
-        
-        
+        return self.sigmoid(self.number-i-1, 0.2, np.random.uniform(0.7,1.3,np.shape(i)), 0, 5, transform=lambda x: x)
+        
+    def spherical(self, r, phi, theta):
+        """(N, 3) offsets of length ``r`` at angle ``phi`` from -z, azimuth ``theta``."""
+        r, phi, theta = np.broadcast_arrays(r, phi, theta)
+        return np.stack([
+            r * np.sin(phi) * np.cos(theta),
+            r * np.sin(phi) * np.sin(theta),
+            - r * np.cos(phi),
+        ], axis=-1)
+
+    def grow(self, parents, points):
+        """Append ``points`` joined by an edge to their ``parents``; return their indices."""
+        indices = np.arange(len(self.vertices), len(self.vertices) + len(points))
+        self.vertices = np.concatenate([self.vertices, points])
+        self.edges = np.concatenate([self.edges, np.stack([parents, indices], axis=-1)])
+        return indices
+
+    def generate_rachis(self, distance_function = None, theta = 0, phi = 0):
+        """The main axis: ``number`` segments hanging from ``position_base``."""
         if distance_function is None:
             distance_function = self.distance_rachis
             
-        self.mesh_branch = bmesh.new()
-        verts = [self.mesh_branch.verts.new(self.position_base)]
-        vertices_base = []
+        self.vertices = np.array([self.position_base], dtype=np.float64)
+        self.edges = np.empty((0, 2), dtype=np.int64)
         
-        for i in range(self.number):
-            r = distance_function(i)
-            ret = bmesh.ops.extrude_vert_indiv(self.mesh_branch, verts=verts)
-            
-            sign = lambda x: bool(x > 0) - bool(x < 0)
-            phi = uniform(*phi_bound)
-            theta = sign(uniform(-1,1))*90
-            theta = 0
-            phi = 0
-            
-            x = r * math.sin(phi) * math.cos(theta)
-            y = r * math.sin(phi) * math.sin(theta)
-            z = - r * math.cos(phi)
-            
-            ret['verts'][0].co += Vector([x,y,z])
-            verts = ret['verts']
-            vertices_base.append(ret['verts'][0])
-                
-            
-        self.vertices_base = vertices_base
-        
-    def generate_first_order_routine(self, verts, generation=1, index=1, distance_function = None, theta = 0, phi = 0):
-        
-        ret = bmesh.ops.extrude_vert_indiv(self.mesh_branch, verts=verts)
+        offsets = self.spherical(distance_function(np.arange(self.number)), phi, theta)
+        points = self.vertices[0] + np.cumsum(offsets, axis=0)
+        self.vertices_base = self.grow(np.arange(self.number), points)
         
+    def generate_first_orders(self, distance_function = None, theta = 0, phi = math.pi/4):
+        """One first-order branch on every rachis node but the last, all at once.
+
+        The branch on node ``index`` has ``ceil(6/(index+1))`` segments, one
+        less when that is above 2; every branch vertex carries a berry.
+        """
         if distance_function is None:
             distance_function = self.distance_first_orders
-            
-        r = distance_function(index)
-        phi = phi
         
-        for v in ret['verts']:
-            x = r * math.sin(phi) * math.cos(theta)
-            y = r * math.sin(phi) * math.sin(theta)
-            z = - r * math.cos(phi)
-            
-            v.co += Vector([x,y,z])
-             
-        
-        return ret['verts']
+        index = np.arange(len(self.vertices_base)-1)
+        n_second_order = np.ceil(6/(index+1)).astype(np.int64)
+        steps = np.where(n_second_order > 2, n_second_order-1, n_second_order)
+        branch = np.repeat(index, steps)
+        starts = np.cumsum(steps) - steps
+        
+        # offsets summed along each branch only
+        offsets = self.spherical(distance_function(branch), phi, theta)
+        total = np.cumsum(offsets, axis=0)
+        before = np.concatenate([np.zeros((1, 3)), total])[starts]
+        points = self.vertices[self.vertices_base[branch]] + total - np.repeat(before, steps, axis=0)
+        
+        first = len(self.vertices)
+        parents = np.arange(first-1, first-1+len(points))
+        parents[starts] = self.vertices_base[index]
+        ret = self.grow(parents, points)
+        self.finitions.extend(points, ret)
     
-        
-    def generate_first_order(self, index, theta, phi, theta_bound = (-math.pi, math.pi), phi_bound = (-math.pi/3, math.pi/3)):
-        ret = [self.vertices_base[index]]
-        n_second_order = math.ceil(6/(index+1))
-        
-        if n_second_order > 2:
-            last = 1
-        else:
-            last = 0
-            
-        theta_second_order = uniform(*theta_bound)
-        for i in range(n_second_order-last):
-            current_theta = theta+index*2*math.pi/3
-            current_theta = 0
-            ret = self.generate_first_order_routine(ret, generation=i, index=index,theta=current_theta, phi=math.pi/4)
-            
-#            ret_second = self.generate_first_order_routine(
-#                ret,
-#                generation=1,
-#                index=1,
-#                distance_function = lambda _ : 1.4,
-#                theta = theta_second_order+i*2*60,
-#                phi = 0
-#            )
-#             
-            self.finitions = [*self.finitions, *ret]
-        
-    def generate_first_orders(self, theta_bound = (-math.pi, math.pi), phi_bound = (0, math.pi/2)):
-        sign = lambda x: bool(x > 0) - bool(x < 0)
-        
-        phi = uniform(*phi_bound)
-        phi_sign = sign(phi)
-        phi = phi_sign * max(abs(phi), 20)
-        
-        theta = uniform(*theta_bound)
-        
-        for i in range(len(self.vertices_base)-1):
-            self.generate_first_order(i, theta, phi)
-    
-    def draw_bairies(self):
-        grappes = []
-        for i, vert in enumerate(self.finitions):
-            mesh = bpy.data.meshes.new(f'baie_{vert.index}')
-
+    def draw_bairies(self, diameter=0.5, mode="instances", relax=4, cull=None):
+        """A berry on every first-order branch vertex.
 
-            # Construct the bmesh sphere and assign it to the blender mesh.
-            bm_temp = bmesh.new()
-            bmesh.ops.create_uvsphere(bm_temp, u_segments=32, v_segments=16, diameter=0.5)
-            print(self.mesh_branch.verts)
-            bmesh.ops.translate(
-                bm_temp,
-                verts=bm_temp.verts,
-                vec=vert.co.to_tuple()
-            )
-            
-            bm_temp.to_mesh(mesh)
-            bm_temp.free()
-
-            obj_grappe_temp = bpy.data.objects.new(f'baie_{i}', mesh)
-            bpy.context.collection.objects.link(obj_grappe_temp)
-            obj_grappe_temp.select_set(True)
-            bpy.ops.object.shade_smooth()
-            grappes.append(obj_grappe_temp)
-        
-    def construct_branches(self):
-        me = bpy.data.meshes.new("branches")
-        self.mesh_branch.to_mesh(me)
-#        self.mesh_branch.free()
-
-
-        # Add the mesh to the scene
-        obj = bpy.data.objects.new("branches", me)
-        bpy.context.collection.objects.link(obj)
-
-        # Select and make active
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
-        bpy.ops.object.modifier_add(type='SKIN')
-        bpy.ops.object.modifier_add(type='SUBSURF')
-        bpy.context.object.modifiers["Subdivision"].levels = 4
+        Returns the berry objects and the number of culled berries, see
+        ``blender_mesh.draw_berries``.
+        """
+        return draw_berries("baies", self.finitions, diameter, mode=mode, relax=relax, cull=cull)
         
-        bpy.ops.object.editmode_toggle()
-        bpy.ops.mesh.select_all(action='SELECT')
-        size = 0.1
-        bpy.ops.transform.skin_resize(value=(size, size , size), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=True, proportional_edit_falloff='SMOOTH', proportional_size=0.564474, use_proportional_connected=False, use_proportional_projected=False)
-
-
-        bpy.ops.object.editmode_toggle()
+    def construct_branches(self, radius=0.025, resolution=8):
+        return draw_tubes("branches", self.vertices, self.edges, radius, resolution)
 
 grape = Grape()
 grape.generate_rachis()
@@ -1,11 +1,12 @@
-import bpy
-import bmesh
 import operator
 import mathutils
 from dataclasses import dataclass, field
-from copy import deepcopy
 from typing import *
 import math 
+from rewriting import derive, iter_derivation, iter_modules, rewrite
+from berries import BerryBuffer
+from blender_mesh import draw_tubes
+from lod import HIGH
 
 @dataclass
 class Turtle:
@@ -35,49 +36,33 @@ class Drawer:
     start_point : Tuple[float] = (0,0,0)
     stack : List[Any] = field(default_factory=list)
     vertices : List[Any] = field(default_factory=list)
+    edges : List[Any] = field(default_factory=list)
     pen_down: bool = False
     
     def __post_init__(self):
-        self.bmesh = bmesh.new()
-        self.vertices.append(self.bmesh.verts.new(self.start_point))
+        self.vertices.append(tuple(self.start_point))
         
     
     def push_state(self, vertice, t):
-        self.stack.append([vertice, deepcopy(t)])
+        self.stack.append([vertice, t.start_point, t.transform.copy()])
     
     def pop_state(self):
-        return self.stack.pop()
+        """The ``[vertice, turtle]`` pushed last, the turtle rebuilt around its saved transform."""
+        vertice, start_point, transform = self.stack.pop()
+        turtle = Turtle(start_point)
+        turtle.transform = transform
+        return [vertice, turtle]
     
     def forward(self, t, length):
-        
-        vertice = self.bmesh.verts.new(operator.matmul(t.transform, mathutils.Vector((0, 0, length))))
-        self.vertices.append(vertice)
-#        self.connect(self.vertices[-2], self.vertices[-1])
-        
-        return vertice
+        """Add a vertex ``length`` ahead of the turtle and return its index."""
+        self.vertices.append(operator.matmul(t.transform, mathutils.Vector((0, 0, length)))[:])
+        return len(self.vertices) - 1
         
     def connect(self, v1, v2):
-        self.bmesh.edges.new((v1, v2))
-        
-    def exec(self):
-        me = bpy.data.meshes.new("branches")
-        self.bmesh.to_mesh(me)
-        
-        obj = bpy.data.objects.new("branches", me)
-        bpy.context.collection.objects.link(obj)
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
-        bpy.ops.object.modifier_add(type='SKIN')
-        bpy.ops.object.modifier_add(type='SUBSURF')
-        bpy.context.object.modifiers["Subdivision"].levels = 4
+        self.edges.append((v1, v2))
         
-        bpy.ops.object.editmode_toggle()
-        bpy.ops.mesh.select_all(action='SELECT')
-        size = 0.1
-        bpy.ops.transform.skin_resize(value=(size, size , size), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True, use_proportional_edit=True, proportional_edit_falloff='SMOOTH', proportional_size=0.564474, use_proportional_connected=False, use_proportional_projected=False)
-
-
-        bpy.ops.object.editmode_toggle()
+    def exec(self, radius=0.025, resolution=8):
+        return draw_tubes("branches", self.vertices, self.edges, radius, resolution)
 
         
 @dataclass
@@ -91,99 +76,87 @@ class GrapeLSystem:
     position_base = (0,0,0) 
     phi = 0
     theta = 0
+    predecessors = ("Ar", "Af", "Ae", "Ap")
 
-    def extract_rules(self, string):
-        replacements = []
-        for k, c in enumerate(string):
-            if c == "A" and k < len(string)-1 and string[k+1] in ["r", "f", "e", "p"]:
-                next_string = string[k:].split(")")[0]
-                i = int(float(next_string[3:].split(',')[0]))
-
-                if string[k+1] != "e" and string[k+1] != "p":
-                    j = float((next_string[3:].split(',')[1]).replace(" ", ""))
+    def production(self, name, args):
+        i = int(float(args.split(',')[0]))
 
-                if string[k+1] == "r":
-                    if i == 1:
-                        new_comand = f"Ae({int(j*self.rl)})"
-                    if i > 1:
-                        new_comand = f"F({j})[//Ar({i-1}, {j*self.rl})][+({self.alpha})Af({self.ns[i-2]}, {j*self.rl})]"
+        if name != "Ae" and name != "Ap":
+            j = float((args.split(',')[1]).replace(" ", ""))
 
-                if string[k+1] == "f":
-                    if i > 1:
-                        new_comand = f"F({j})[//Af({i-1}, {j*self.rl})][+({self.alpha})Ae({j*self.rl})]"
-                    if i == 1:
-                        new_comand = f"Ae({int(j*self.rl)})"
+        if name == "Ar":
+            if i == 1:
+                return f"Ae({int(j*self.rl)})"
+            return f"F({j})[//Ar({i-1}, {j*self.rl})][+({self.alpha})Af({self.ns[i-2]}, {j*self.rl})]"
 
-                if string[k+1] == "e":
-                    new_comand = f"F({i})[Ap({int(i*self.rl)})][+({self.alpha})Ap({int(i*self.rl)})][-({self.alpha})Ap({int(i*self.rl)})]"
+        if name == "Af":
+            if i == 1:
+                return f"Ae({int(j*self.rl)})"
+            return f"F({j})[//Af({i-1}, {j*self.rl})][+({self.alpha})Ae({j*self.rl})]"
 
-                if string[k+1] == "p":
-                    new_comand = f"F({i})S({int(self.l*self.rr)})"
+        if name == "Ae":
+            return f"F({i})[Ap({int(i*self.rl)})][+({self.alpha})Ap({int(i*self.rl)})][-({self.alpha})Ap({int(i*self.rl)})]"
 
-                replacements.append([k, k + len(next_string), new_comand])
+        return f"F({i})S({int(self.l*self.rr)})"
 
-        decalage = 0
-
-        for replacement in replacements:
-            start, end, new_comand = replacement
-            length_diff = len(new_comand) - (end-start)
-
-            before = string[:max(0, start+decalage)]
-            after = string[min(end+decalage, len(string)):]
-
-            string = before + new_comand + after
-
-            decalage += length_diff
+    def extract_rules(self, string):
+        return rewrite(string, self.production, self.predecessors)
 
-        return string
+    def iterate(self, n_iter: Optional[int] = 10):
+        """Derive from ``Ar(m,l)``, stopping early once nothing is left to rewrite.
 
-    def iterate(self, n_iter: int = 10):
+        ``self.iterations`` is the number of steps actually used; with
+        ``n_iter=None`` the derivation runs until that fixed point.
+        """
         omega = f"Ar({self.m},{self.l})"
+        self.instructions, self.iterations = derive(omega, self.production, self.predecessors, n_iter)
 
-        for iteration in range(n_iter):
-            omega = self.extract_rules(omega)
-        self.instructions = omega
-        
-    def draw(self):
-        cursor = 0
+    def stream(self, n_iter: Optional[int] = 10):
+        """Modules of the derivation, expanded depth-first as ``draw`` reads them."""
+        return iter_derivation(f"Ar({self.m},{self.l})", self.production, self.predecessors, n_iter)
         
+    def draw(self, lod=HIGH, modules=None):
+        if modules is None:
+            modules = iter_modules(self.instructions)
         turtle = Turtle()
         drawer = Drawer(start_point=(0,0,0))
         turtle.rotate_x(math.pi)
-        vertice = drawer.vertices[0]
+        vertice = 0
         
         
-        self.finitions = []
+        self.finitions = BerryBuffer()
+        pedicels = set()
+        previous = None
         
-        while cursor < len(self.instructions):
-            char = self.instructions[cursor]
-            temp_string = self.instructions[cursor:]
-            
-            if char == "F":
-                param = float(temp_string[2:].split(')')[0])
+        for name, params in modules:
+            if name == "F":
+                param = params[0]
                 turtle.forward(param)
                 vertice_old = vertice
                 vertice = drawer.forward(turtle, param)
                 drawer.connect(vertice_old, vertice)
-            elif char == "/" and self.instructions[cursor+1] != "(":
+            elif name == "/" and not params:
                 turtle.rotate_z(math.pi/2)
-            elif char == "[":
+            elif name == "[":
                 drawer.push_state(vertice, turtle)
-            elif char == "]":
+            elif name == "]":
                 vertice, turtle = drawer.pop_state()
-            elif char == "+":
-                param = float(temp_string[2:].split(')')[0])
+            elif name == "+":
+                param = params[0]
                 turtle.rotate_x(math.radians(param))
-            elif char == "-":
-                param = float(temp_string[2:].split(')')[0])
+            elif name == "-":
+                param = params[0]
                 turtle.rotate_x(math.radians(-param))
-            elif char == "S":
+            elif name == "S":
+                if previous == "F":
+                    pedicels.add(len(drawer.edges) - 1)
                 vertice = drawer.forward(turtle, param)
-                self.finitions = [*self.finitions, vertice]
-
-            cursor += 1
+                self.finitions.append(drawer.vertices[vertice], vertice)
+            previous = name
 
-        drawer.exec()
+        if not lod.pedicels:
+            drawer.edges = [edge for k, edge in enumerate(drawer.edges) if k not in pedicels]
+        drawer.exec(resolution=lod.resolution)
 
     
 
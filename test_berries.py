@@ -0,0 +1,23 @@
+"""
+``GrapeLSystem.geometry`` hangs one berry per vertex, so relaxing the
+berries only nudges them off their vertex instead of splitting stacked
+pairs apart.
+"""
+import numpy as np
+import pytest
+
+from berries import relax
+from grape_lsystem import GrapeLSystem
+
+
+@pytest.mark.parametrize("m, ns, n_iter", [(3, [1, 2], 20), (4, [2, 1, 2], 20)])
+def test_relaxed_berries_stay_on_their_vertex(m, ns, n_iter):
+    grappe = GrapeLSystem(m=m, ns=ns, l=1)
+    grappe.iterate(n_iter=n_iter)
+    geometry = grappe.geometry()
+    radius = 0.5
+
+    assert len(np.unique(geometry.finitions)) == len(geometry.finitions)
+    points = geometry.vertices[geometry.finitions]
+    moved = np.linalg.norm(relax(points, radius) - points, axis=1)
+    assert moved.max() <= radius
@@ -0,0 +1,83 @@
+"""
+Regression test for ``rewriting.iter_modules``: ``lsystem_3.GrapeLSystem.draw``,
+which walks the derivation with it, draws the same skeleton as the slicing
+parser it replaced.
+
+BASELINE was recorded with the draw() of the original lsystem_3.py, rounded
+to 6 decimals. lsystem_3 only touches Blender in its pens and script, so
+bpy and mathutils are stubbed when they are not installed.
+"""
+import importlib
+import sys
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from rewriting import iter_modules
+
+for name in ("bpy", "mathutils"):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        sys.modules[name] = MagicMock()
+
+import lsystem_3
+
+
+# m, ns, n_iter, vertices, edges, finition vertices
+BASELINE = [
+    (3, [1, 2], 10, [
+        (0.0, 0.0, 0.0), (0.0, 0.0, -1.0), (0.0, 0.0, -2.0), (0.0, 0.0, -3.0), (0.0, 0.0, -4.0),
+        (-0.2006, 0.678056, -3.707107), (0.2006, -0.678056, -3.707107),
+        (-0.423175, -0.5665, -2.707107), (-0.431378, -0.577482, -3.707013),
+        (-0.852111, -1.140713, -3.404455), (-0.00584, -0.007818, -3.42384),
+        (0.707107, 0.0, -1.707107), (0.698903, -0.010982, -2.707013),
+        (0.69876, -0.011173, -3.707013), (0.275627, -0.577618, -3.41395),
+        (1.121977, 0.555383, -3.414289), (1.42384, 0.0, -2.404455), (1.437786, 0.0, -3.404357),
+        (2.140739, 0.0, -3.101631), (0.726663, 0.0, -3.121355),
+    ], [
+        (0, 1), (1, 2), (2, 3), (3, 4), (3, 5), (3, 6), (2, 7), (7, 8), (7, 9), (7, 10), (1, 11),
+        (11, 12), (12, 13), (12, 14), (12, 15), (11, 16), (16, 17), (16, 18), (16, 19),
+    ], [
+        4, 5, 6, 8, 9, 10, 13, 14, 15, 17, 18, 19,
+    ]),
+    (4, [2, 1, 2], 8, [
+        (0.0, 0.0, 0.0), (0.0, 0.0, -1.0), (0.0, 0.0, -2.0), (0.0, 0.0, -3.0), (0.0, 0.0, -4.0),
+        (0.0, 0.0, -5.0), (0.663277, -0.245078, -4.707107), (-0.663277, 0.245078, -4.707107),
+        (-0.2006, 0.678056, -3.707107), (-0.187742, 0.673305, -4.707013),
+        (-0.187518, 0.673222, -5.707013), (0.475694, 0.428168, -5.413951),
+        (-0.850861, 0.918325, -5.414289), (-0.403931, 1.365342, -4.404455),
+        (-0.407887, 1.378716, -5.404357), (-0.607309, 2.052789, -5.101631),
+        (-0.206148, 0.696809, -5.121355), (-0.423175, -0.5665, -2.707107),
+        (-0.431378, -0.577482, -3.707013), (-0.852111, -1.140713, -3.404455),
+        (-0.00584, -0.007818, -3.42384), (0.707107, 0.0, -1.707107),
+        (0.698903, -0.010982, -2.707013), (0.69876, -0.011173, -3.707013),
+        (0.275627, -0.577618, -3.41395), (1.121977, 0.555383, -3.414289),
+        (1.42384, 0.0, -2.404455), (1.437786, 0.0, -3.404357), (2.140739, 0.0, -3.101631),
+        (0.726663, 0.0, -3.121355),
+    ], [
+        (0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (4, 6), (4, 7), (3, 8), (8, 9), (9, 10), (9, 11),
+        (9, 12), (8, 13), (13, 14), (13, 15), (13, 16), (2, 17), (17, 18), (17, 19), (17, 20),
+        (1, 21), (21, 22), (22, 23), (22, 24), (22, 25), (21, 26), (26, 27), (26, 28), (26, 29),
+    ], [
+        5, 6, 7, 10, 11, 12, 14, 15, 16, 18, 19, 20, 23, 24, 25, 27, 28, 29,
+    ]),
+]
+
+
+@pytest.mark.parametrize("m, ns, n_iter, vertices, edges, finitions", BASELINE)
+def test_draw_matches_slicing_baseline(m, ns, n_iter, vertices, edges, finitions):
+    grappe = lsystem_3.GrapeLSystem(m=m, ns=ns)
+    grappe.iterate(n_iter=n_iter)
+    grappe.draw()
+
+    np.testing.assert_allclose(grappe.vertices, vertices, atol=1e-6)
+    assert [tuple(e) for e in grappe.edges] == edges
+    assert grappe.finitions.indices.tolist() == finitions
+
+
+def test_iter_modules_params():
+    assert list(iter_modules("F(2)[//Ar(1, 3.5)]S(0)")) == [
+        ("F", (2.0,)), ("[", ()), ("/", ()), ("/", ()), ("Ar", (1.0, 3.5)), ("]", ()), ("S", (0.0,)),
+    ]
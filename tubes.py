@@ -0,0 +1,99 @@
+"""
+Generalized-cylinder meshing of branch skeletons.
+
+Turns the vertex/edge skeleton the drawers produce into open-ended tubes
+of quads, with a ring of ``resolution`` vertices around every joint, so the
+branches need no Skin + Subdivision modifier stack. Everything is computed
+with NumPy on plain CPython.
+
+The default radius of 0.025 is the old stack's: the Skin modifier starts
+every vertex at 0.25 and the scripts scaled it by 0.1 with skin_resize.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+TubeMesh = namedtuple("TubeMesh", "vertices, faces")
+
+# reference heading the ring frames are rotated from, the turtle's start
+DOWN = np.array([0.0, 0.0, -1.0])
+
+
+def normalized(vectors, fallback):
+    """Unit vectors, ``fallback`` wherever a vector has no length."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.where(norms > 1e-12, vectors / np.where(norms > 1e-12, norms, 1), fallback)
+
+
+def ring_frames(tangents):
+    """Two unit normals per tangent, spanning the plane of its ring.
+
+    Each frame is the smallest rotation taking ``DOWN`` to the tangent, so
+    rings along a gently bending branch stay aligned with each other. The
+    one tangent that rotation is undefined for, straight up, uses a half
+    turn around X.
+    """
+    v = np.cross(DOWN, tangents)
+    c = tangents @ DOWN
+    k = np.zeros((len(tangents), 3, 3))
+    k[:, 0, 1], k[:, 0, 2], k[:, 1, 2] = -v[:, 2], v[:, 1], -v[:, 0]
+    k -= k.transpose(0, 2, 1)
+
+    up = c < -1 + 1e-9
+    scale = np.where(up, 0, 1 / np.where(up, 1, 1 + c))
+    rotations = np.identity(3) + k + k @ k * scale[:, None, None]
+    rotations[up] = np.diag([1.0, -1.0, -1.0])
+    return rotations[:, :, 0], rotations[:, :, 1]
+
+
+def tube_mesh(vertices, edges, radius=0.025, resolution=8):
+    """Quad tubes around every edge of a skeleton.
+
+    ``radius`` is a scalar or one value per vertex. An edge that is the
+    first child of its parent edge shares the parent's end ring, whose
+    normal bisects both edges, so unbranched chains are one continuous
+    tube; other children start a ring of their own inside the parent.
+    Returns a ``TubeMesh`` of (R * resolution, 3) vertices and (Q, 4) faces.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), len(vertices))
+    if not len(edges):
+        return TubeMesh(np.empty((0, 3)), np.empty((0, 4), dtype=np.int32))
+
+    start, end = edges[:, 0], edges[:, 1]
+    n_edges = len(edges)
+    index = np.arange(n_edges)
+    direction = normalized(vertices[end] - vertices[start], DOWN)
+
+    incoming = np.full(len(vertices), -1)
+    incoming[end] = index
+    first_child = np.full(len(vertices), n_edges)
+    np.minimum.at(first_child, start, index)
+
+    parent = incoming[start]
+    continues = (parent >= 0) & (first_child[start] == index)
+    child = first_child[end]
+    has_child = child < n_edges
+
+    # rings 0..E-1 sit at the end of each edge, the rest start new tubes
+    new = ~continues
+    start_ring = np.where(continues, parent, n_edges + np.cumsum(new) - 1)
+
+    bisector = direction + np.where(has_child[:, None], direction[np.minimum(child, n_edges - 1)], 0)
+    tangents = np.concatenate([normalized(bisector, direction), direction[new]])
+    centers = np.concatenate([vertices[end], vertices[start[new]]])
+    radii = np.concatenate([radius[end], radius[start[new]]])
+
+    u, v = ring_frames(tangents)
+    angles = np.linspace(0, 2*np.pi, resolution, endpoint=False)
+    offsets = np.cos(angles)[None, :, None] * u[:, None, :] + np.sin(angles)[None, :, None] * v[:, None, :]
+    ring_vertices = centers[:, None, :] + radii[:, None, None] * offsets
+
+    j = np.arange(resolution)
+    j_next = (j + 1) % resolution
+    a = start_ring[:, None] * resolution
+    b = index[:, None] * resolution
+    faces = np.stack([a + j, b + j, b + j_next, a + j_next], axis=-1)
+    return TubeMesh(ring_vertices.reshape(-1, 3), faces.reshape(-1, 4).astype(np.int32))
@@ -0,0 +1,295 @@
+"""
+NumPy turtle for GrapeLSystem derivations.
+
+Mirrors the mathutils Turtle/Drawer pair the Blender scripts use, but keeps
+the geometry in arrays so a derivation can be turned into vertices and
+edges on a plain CPython interpreter, without ``bpy`` or ``mathutils``.
+"""
+import math
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from rewriting import ARITY, F, PLUS, MINUS, SLASH, PUSH, POP, S, CUT
+
+
+Geometry = namedtuple("Geometry", "vertices, edges, finitions")
+
+# index pairs of the plane each rotation acts on, mathutils axis convention
+PLANES = {"X": (1, 2), "Y": (2, 0), "Z": (0, 1)}
+
+
+@lru_cache(maxsize=None)
+def rotation(angle, axis):
+    """4x4 rotation matrix, same as ``mathutils.Matrix.Rotation(angle, 4, axis)``.
+
+    Matrices are cached per angle and shared, so they are read-only.
+    """
+    i, j = PLANES[axis]
+    c, s = math.cos(angle), math.sin(angle)
+    matrix = np.identity(4)
+    matrix[i, i] = c
+    matrix[i, j] = -s
+    matrix[j, i] = s
+    matrix[j, j] = c
+    matrix.flags.writeable = False
+    return matrix
+
+
+class StateStack:
+    """Preallocated stack of turtle transforms and vertex indices.
+
+    Pushing copies the 4x4 transform into the next free slot and popping
+    copies it back into the turtle, so brackets do not allocate; capacity
+    doubles on the rare push past the deepest bracket seen so far.
+    """
+
+    def __init__(self, capacity=64):
+        self.transforms = np.empty((capacity, 4, 4))
+        self.vertices = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def push(self, transform, vertex):
+        if self.size == len(self.vertices):
+            self.transforms = np.concatenate([self.transforms, np.empty_like(self.transforms)])
+            self.vertices = np.concatenate([self.vertices, np.empty_like(self.vertices)])
+        self.transforms[self.size] = transform
+        self.vertices[self.size] = vertex
+        self.size += 1
+
+    def pop(self, transform):
+        """Restore the last pushed transform into ``transform``, return its vertex."""
+        self.size -= 1
+        transform[...] = self.transforms[self.size]
+        return int(self.vertices[self.size])
+
+
+class Turtle:
+    def __init__(self):
+        self.transform = np.identity(4)
+        self.scratch = np.empty((4, 4))
+
+    def rotate(self, angle, axis):
+        np.matmul(self.transform, rotation(angle, axis), out=self.scratch)
+        self.transform, self.scratch = self.scratch, self.transform
+
+    def rotate_x(self, angle):
+        self.rotate(angle, "X")
+
+    def rotate_y(self, angle):
+        self.rotate(angle, "Y")
+
+    def rotate_z(self, angle):
+        self.rotate(angle, "Z")
+
+    def forward(self, length):
+        self.transform[:3, 3] += self.transform[:3, 2] * length
+
+
+class Drawer:
+    """Vertices and edges kept as flat typed arrays, three and two values each."""
+
+    def __init__(self, start_point=(0, 0, 0)):
+        self.vertices = array("d", start_point)
+        self.edges = array("q")
+        self.stack = StateStack()
+
+    def push_state(self, vertex, t):
+        self.stack.push(t.transform, vertex)
+
+    def pop_state(self, t):
+        return self.stack.pop(t.transform)
+
+    def forward(self, t, length):
+        """Add a vertex ``length`` ahead of the turtle, as Drawer.forward does."""
+        self.vertices.extend((t.transform[:3, 3] + t.transform[:3, 2] * length).tolist())
+        return len(self.vertices) // 3 - 1
+
+    def connect(self, v1, v2):
+        self.edges.append(v1)
+        self.edges.append(v2)
+
+    def arrays(self):
+        vertices = np.frombuffer(self.vertices, dtype=np.float64).reshape(-1, 3).copy()
+        edges = np.frombuffer(self.edges, dtype=np.int64).reshape(-1, 2).astype(np.int32)
+        return vertices, edges
+
+
+def draw(modules, start_point=(0, 0, 0)):
+    """Interpret a ModuleString into a ``Geometry`` of NumPy arrays.
+
+    ``finitions`` holds the index of the vertex every ``S`` module ends on.
+    """
+    turtle = Turtle()
+    drawer = Drawer(start_point)
+    turtle.rotate_x(math.pi)
+    vertex = 0
+
+    finitions = []
+
+    for code, params in modules:
+        if code == F:
+            turtle.forward(params[0])
+            vertex_old = vertex
+            vertex = drawer.forward(turtle, params[0])
+            drawer.connect(vertex_old, vertex)
+        elif code == SLASH:
+            turtle.rotate_z(math.pi/2)
+        elif code == PUSH:
+            drawer.push_state(vertex, turtle)
+        elif code == POP:
+            vertex = drawer.pop_state(turtle)
+        elif code == PLUS:
+            turtle.rotate_x(math.radians(params[0]))
+        elif code == MINUS:
+            turtle.rotate_x(math.radians(-params[0]))
+        elif code == S:
+            finitions.append(vertex)
+
+    vertices, edges = drawer.arrays()
+    return Geometry(vertices, edges, np.array(finitions, dtype=np.int32))
+
+
+def pedicels(modules):
+    """Boolean mask over the ``F`` segments, true for pedicels.
+
+    A pedicel is a segment directly followed by an ``S`` berry or a ``%``
+    cut, the stalk a berry hangs from.
+    """
+    codes = np.frombuffer(modules.codes, dtype=np.uint8)
+    following = np.append(codes[1:], 255)
+    return np.isin(following, (S, CUT))[codes == F]
+
+
+def segment_tree(modules):
+    """Bracket tree of a ModuleString, one entry per ``F`` segment.
+
+    Returns the parent segment of every segment (-1 for the root), its depth
+    in the tree, its length, the (N, 3, 3) rotation the turtle applies
+    between the parent and the segment, and the segment each ``S`` module
+    ends on.
+
+    The turtle state before a module is the state after the module before
+    it, or after the matching ``[`` when that one is a ``]``, and ``F``
+    starts again from no rotation. Following those links by pointer
+    doubling gives every module the last segment drawn and the rotations
+    since, in a few batched steps instead of one Python step per module.
+    """
+    codes = np.frombuffer(modules.codes, dtype=np.uint8)
+    params = np.frombuffer(modules.params, dtype=np.float32)
+    arity = np.array(ARITY)[codes]
+    offsets = np.cumsum(arity) - arity
+    keep = np.flatnonzero(np.isin(codes, (F, SLASH, PLUS, MINUS, PUSH, POP, S)))
+    codes, offsets = codes[keep], offsets[keep]
+    n = len(codes)
+
+    # matching "[" of every "]": sorted by nesting level, each "]" follows its "["
+    push, pop = codes == PUSH, codes == POP
+    level = np.cumsum(push) - np.cumsum(pop) + pop
+    brackets = np.flatnonzero(push | pop)
+    brackets = brackets[np.lexsort((brackets, level[brackets]))]
+    closing = np.flatnonzero(codes[brackets] == POP)
+    match = np.empty(n, dtype=np.int64)
+    match[brackets[closing]] = brackets[closing - 1]
+
+    # node n is the turtle at the start of the string
+    link = np.arange(-1, n)
+    link[:1] = n
+    link[n] = n
+    after = np.flatnonzero(pop[:-1]) + 1
+    link[after] = match[after - 1]
+
+    angles = np.zeros(n)
+    for code, sign in ((PLUS, 1), (MINUS, -1)):
+        k = np.flatnonzero(codes == code)
+        angles[k] = sign * np.radians(params[offsets[k]].astype(np.float64))
+    drawn = np.append(codes == F, True)
+    turning = np.flatnonzero((angles != 0) | (codes == SLASH))
+
+    # last segment drawn before every module, and its segment index
+    stop = ancestor(link, drawn)
+    segment = np.append(np.cumsum(codes == F) - 1, -1)
+    anchor = segment[stop]
+
+    # rotations since then, composed over the turning modules only
+    marked = drawn.copy()
+    marked[turning] = True
+    stop = ancestor(link, marked)
+    t = len(turning)
+    index = np.full(n + 1, t)
+    index[turning] = np.arange(t)
+    turns = np.tile(np.identity(3), (t + 1, 1, 1))
+    c, s = np.cos(angles[turning]), np.sin(angles[turning])
+    turns[:t, 1, 1], turns[:t, 1, 2], turns[:t, 2, 1], turns[:t, 2, 2] = c, -s, s, c
+    quarter = codes[turning] == SLASH
+    turns[:t][quarter] = rotation(math.pi/2, "Z")[:3, :3]
+    jump = np.append(index[stop[link[turning]]], t)
+    while True:
+        live = np.flatnonzero(jump != t)
+        if not len(live):
+            break
+        j = jump[live]
+        turns[live] = turns[j] @ turns[live]
+        jump[live] = jump[j]
+
+    f = np.flatnonzero(codes == F)
+    parents = anchor[link[f]]
+    local = turns[index[stop[link[f]]]]
+    lengths = params[offsets[f]].astype(np.float64)
+    finitions = anchor[link[np.flatnonzero(codes == S)]]
+    return parents, tree_depths(parents), lengths, local, finitions
+
+
+def ancestor(link, marked):
+    """Nearest marked node up the ``link`` chain of every node, the node itself included."""
+    jump = np.where(marked, np.arange(len(link)), link)
+    while True:
+        next = jump[jump]
+        if (next == jump).all():
+            return jump
+        jump = next
+
+
+def tree_depths(parents):
+    """Depth of every node of a tree given by its parents (-1 for roots), by pointer doubling."""
+    depths = (parents >= 0).astype(np.int64)
+    jump = parents.copy()
+    while True:
+        live = np.flatnonzero(jump >= 0)
+        if not len(live):
+            return depths
+        j = jump[live]
+        depths[live] += depths[j]
+        jump[live] = jump[j]
+
+
+def draw_vectorized(modules, start_point=(0, 0, 0)):
+    """Same ``Geometry`` as ``draw``, with the transforms computed in batches.
+
+    The segment tree is built with array operations (``segment_tree``);
+    segment orientations are then the product of the parent's orientation
+    and the segment's local rotation, evaluated one tree depth at a time.
+    """
+    parents, depths, lengths, local, finitions = segment_tree(modules)
+    n = len(lengths)
+
+    # index n is the root: the turtle turned upside down at the origin
+    orientation = np.empty((n + 1, 3, 3))
+    orientation[n] = rotation(math.pi, "X")[:3, :3]
+    position = np.zeros((n + 1, 3))
+
+    order = np.argsort(depths, kind="stable")
+    bounds = np.searchsorted(depths[order], np.arange(depths.max(initial=-1) + 2))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        level = order[start:end]
+        parent = parents[level]
+        orientation[level] = orientation[parent] @ local[level]
+        position[level] = position[parent] + orientation[level, :, 2] * lengths[level, None]
+
+    vertices = np.empty((n + 1, 3))
+    vertices[0] = start_point
+    vertices[1:] = position[:n] + orientation[:n, :, 2] * lengths[:, None]
+    edges = np.stack([parents + 1, np.arange(1, n + 1)], axis=1).astype(np.int32)
+    return Geometry(vertices, edges, np.asarray(finitions, dtype=np.int32) + 1)
@@ -1,10 +1,8 @@
-import bpy
-import bmesh
 import operator
 import mathutils
 from dataclasses import dataclass, field
-from copy import deepcopy
 from typing import *
+from blender_mesh import draw_tubes
 
 
 @dataclass
@@ -37,46 +35,30 @@ class Drawer:
     start_point: Tuple[float] = (0, 0, 0)
     stack: List[Any] = field(default_factory=list)
     vertices: List[Any] = field(default_factory=list)
+    edges: List[Any] = field(default_factory=list)
     pen_down: bool = False
 
     def __post_init__(self):
-        self.bmesh = bmesh.new()
-        self.vertices.append(self.bmesh.verts.new(self.start_point))
+        self.vertices.append(tuple(self.start_point))
 
     def push_state(self, vertice, t):
-        self.stack.append([vertice, deepcopy(t)])
+        self.stack.append([vertice, t.start_point, t.transform.copy()])
 
     def pop_state(self):
-        return self.stack.pop()
+        """The ``[vertice, turtle]`` pushed last, the turtle rebuilt around its saved transform."""
+        vertice, start_point, transform = self.stack.pop()
+        turtle = Turtle(start_point)
+        turtle.transform = transform
+        return [vertice, turtle]
 
     def forward(self, t, length):
-
-        vertice = self.bmesh.verts.new(operator.matmul(
-            t.transform, mathutils.Vector((0, 0, length))))
-        self.vertices.append(vertice)
-#        self.connect(self.vertices[-2], self.vertices[-1])
-
-        return vertice
+        """Add a vertex ``length`` ahead of the turtle and return its index."""
+        self.vertices.append(operator.matmul(
+            t.transform, mathutils.Vector((0, 0, length)))[:])
+        return len(self.vertices) - 1
 
     def connect(self, v1, v2):
-        self.bmesh.edges.new((v1, v2))
-
-    def exec(self):
-        me = bpy.data.meshes.new("branches")
-        self.bmesh.to_mesh(me)
-
-        obj = bpy.data.objects.new("branches", me)
-        bpy.context.collection.objects.link(obj)
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
-        bpy.ops.object.modifier_add(type='SKIN')
-        bpy.ops.object.modifier_add(type='SUBSURF')
-        bpy.context.object.modifiers["Subdivision"].levels = 4
-
-        bpy.ops.object.editmode_toggle()
-        bpy.ops.mesh.select_all(action='SELECT')
-        size = 0.1
-        bpy.ops.transform.skin_resize(value=(size, size, size), orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', mirror=True,
-                                      use_proportional_edit=True, proportional_edit_falloff='SMOOTH', proportional_size=0.564474, use_proportional_connected=False, use_proportional_projected=False)
+        self.edges.append((v1, v2))
 
-        bpy.ops.object.editmode_toggle()
+    def exec(self, radius=0.025, resolution=8):
+        return draw_tubes("branches", self.vertices, self.edges, radius, resolution)
@@ -0,0 +1,131 @@
+"""
+Batch generation of grape clusters for vineyard scenes.
+
+Clusters are derived and turned into geometry in worker processes, on
+plain CPython; each comes back as a few compact arrays already placed in
+the scene. ``save`` packs a batch into one ``.npz`` file that a single
+Blender script (vineyard_blender.py) imports.
+
+Run ``python vineyard.py [count] [path]`` to write a vineyard file.
+"""
+import math
+import os
+import random
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import *
+
+import numpy as np
+
+from grape_lsystem import GrapeLSystem
+
+
+Cluster = namedtuple("Cluster", "vertices, edges, finitions, pedicels")
+
+
+@dataclass(frozen=True)
+class ClusterSpec:
+    m: int = 5
+    ns: Tuple[int] = ()
+    l: float = 1
+    rl: float = 1
+    rr: float = 0.75
+    alpha: float = 45
+    n_iter: int = 20
+    position: Tuple[float] = (0, 0, 0)
+    rotation: float = 0
+
+
+def random_specs(count, seed=0, rows=20, spacing=(1.5, 3.0), m=(3, 8), ns=(1, 4), alpha=(30, 60)):
+    """``count`` clusters with random grammars, laid out along vine rows.
+
+    The same ``seed`` always gives the same vineyard.
+    """
+    rng = random.Random(seed)
+    per_row = math.ceil(count / rows)
+    specs = []
+    for k in range(count):
+        row, column = divmod(k, per_row)
+        cluster_m = rng.randint(*m)
+        cluster_ns = tuple(rng.randint(*ns) for i in range(cluster_m - 1))
+        specs.append(ClusterSpec(
+            m=cluster_m,
+            ns=cluster_ns,
+            alpha=rng.uniform(*alpha),
+            n_iter=cluster_m + max(cluster_ns, default=0) + 4,
+            position=(column*spacing[0] + rng.uniform(-0.2, 0.2), row*spacing[1], 0),
+            rotation=rng.uniform(0, 2*math.pi),
+        ))
+    return specs
+
+
+def build_cluster(spec):
+    """Derive one cluster and return its geometry placed in the scene."""
+    grappe = GrapeLSystem(m=spec.m, ns=list(spec.ns), l=spec.l, rl=spec.rl, rr=spec.rr, alpha=spec.alpha)
+    grappe.iterate(n_iter=spec.n_iter)
+    geometry = grappe.geometry()
+
+    c, s = math.cos(spec.rotation), math.sin(spec.rotation)
+    rotation = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    vertices = geometry.vertices @ rotation.T + spec.position
+    return Cluster(
+        vertices.astype(np.float32),
+        geometry.edges.astype(np.int32),
+        geometry.finitions.astype(np.int32),
+        grappe.pedicels(),
+    )
+
+
+def generate(specs, workers=None):
+    """Build every cluster of ``specs`` in a process pool, in order."""
+    specs = list(specs)
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(specs) // (workers * 4))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(build_cluster, specs, chunksize=chunksize))
+
+
+def merge(clusters, pedicels=True):
+    """One vertex/edge skeleton and one berry point array for many clusters.
+
+    With ``pedicels=False`` the berry stalk edges are left out.
+    """
+    if not clusters:
+        return np.empty((0, 3), np.float32), np.empty((0, 2), np.int32), np.empty((0, 3), np.float32)
+
+    vertices = [cluster.vertices for cluster in clusters]
+    offsets = np.cumsum([0] + [len(part) for part in vertices[:-1]])
+    edges = [
+        (cluster.edges if pedicels else cluster.edges[~cluster.pedicels]) + offset
+        for cluster, offset in zip(clusters, offsets)
+    ]
+    berries = [cluster.vertices[cluster.finitions] for cluster in clusters]
+    return np.concatenate(vertices), np.concatenate(edges), np.concatenate(berries)
+
+
+def save(path, clusters):
+    """Pack clusters into one ``.npz`` of concatenated arrays and offsets."""
+    arrays = {}
+    for field in Cluster._fields:
+        parts = [getattr(cluster, field) for cluster in clusters]
+        arrays[field] = np.concatenate(parts) if parts else np.empty(0)
+        arrays[f"{field}_offsets"] = np.cumsum([0] + [len(part) for part in parts])
+    np.savez(path, **arrays)
+
+
+def load(path):
+    """Clusters saved with ``save``."""
+    data = np.load(path)
+    columns = []
+    for field in Cluster._fields:
+        array, offsets = data[field], data[f"{field}_offsets"]
+        columns.append([array[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+    return [Cluster(*arrays) for arrays in zip(*columns)]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    path = sys.argv[2] if len(sys.argv) > 2 else "vineyard.npz"
+    save(path, generate(random_specs(count)))
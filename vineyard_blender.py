@@ -0,0 +1,40 @@
+"""
+Import a vineyard file written by vineyard.py into the current scene.
+
+Clusters are grouped by level of detail from their distance to the scene
+camera; every group becomes one tube mesh for the branches and one
+instanced berry object, whatever the number of clusters. With ``cull``,
+berries buried inside their cluster are dropped or drawn low-poly.
+"""
+import sys
+from collections import defaultdict
+
+import vineyard
+from blender_mesh import camera_distance, draw_culled_spheres, draw_spheres, draw_tubes
+from lod import lod_for_distance
+
+
+def import_vineyard(path, radius=0.025, diameter=0.5, mode="instances", cull=None, collection=None):
+    """Draw the clusters of ``path``; return the objects and the number of culled berries."""
+    groups = defaultdict(list)
+    for cluster in vineyard.load(path):
+        groups[lod_for_distance(camera_distance(cluster.vertices[0]))].append(cluster)
+
+    objects = []
+    culled = 0
+    for k, (lod, clusters) in enumerate(groups.items()):
+        vertices, edges, berries = vineyard.merge(clusters, pedicels=lod.pedicels)
+        objects.append(draw_tubes(f"branches_{k}", vertices, edges, radius, lod.resolution, collection))
+        if cull is None:
+            objects.append(draw_spheres(f"baies_{k}", berries, diameter=diameter, segments=lod.segments,
+                                        rings=lod.rings, mode=mode, collection=collection))
+            continue
+        spheres, buried = draw_culled_spheres(f"baies_{k}", berries, diameter, lod.segments, lod.rings,
+                                              mode, cull, collection=collection)
+        objects.extend(spheres)
+        culled += buried
+    return objects, culled
+
+
+path = sys.argv[sys.argv.index("--") + 1] if "--" in sys.argv else "vineyard.npz"
+import_vineyard(path)